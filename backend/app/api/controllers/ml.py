@@ -1,144 +1,187 @@
+import asyncio
+import gc
 import logging
+import os
 import time
-from typing import Any
+from collections.abc import AsyncIterator
 
 import torch
 from fastapi import APIRouter, Body, Depends, File, HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse
 
 from app.models import (
     ExplainTextRequest,
     ExplainTextResponse,
     LoadModelRequest,
     LoadModelResponse,
+    ModelState,
     PredictionResponse,
+    UnloadModelResponse,
     loaded_model_state,
 )
+from app.services.batching import TextPredictionBatcher
 from app.services.explainability import explain_text
-from app.services.inference import (
-    preprocess_audio,
-    run_lfm2_prediction,
-    run_text_shap_prediction,
-)
+from app.services.inference import preprocess_audio, run_lfm2_prediction
+from app.services.model_guard import ModelStateGuard
 from app.services.model_loader import load_model
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Guards loaded_model_state against concurrent /models/load calls
+model_load_lock = asyncio.Lock()
+
+# Requests hold a read lease on the loaded model; load/unload wait for them to drain first
+model_state_guard = ModelStateGuard()
+
+# Caps concurrent inference/explanation jobs; two jobs on one GPU mostly slow each other down
+inference_semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_INFER", "1")))
+
+text_prediction_batcher = TextPredictionBatcher(
+    semaphore=inference_semaphore,
+    max_batch_size=int(os.getenv("MAX_BATCH", "8")),
+    max_wait_ms=float(os.getenv("MAX_WAIT_MS", "10")),
+)
 
-def get_model_state() -> dict[str, Any]:
-    """Dependency to check for a loaded model."""
-    if not loaded_model_state.get("model"):
-        raise HTTPException(status_code=400, detail="No model loaded. Call POST /models/load first.")
-    return loaded_model_state
+
+async def get_model_state() -> AsyncIterator[ModelState]:
+    """Dependency to check for a loaded model; yields a snapshot leased for the whole request."""
+    async with model_state_guard.read():
+        if loaded_model_state.model is None:
+            raise HTTPException(status_code=400, detail="No model loaded. Call POST /models/load first.")
+        yield loaded_model_state.snapshot()
 
 
 @router.post("/models/load", response_model=LoadModelResponse)
 async def api_load_model(request: LoadModelRequest):
     """Loads a model into memory."""
-    global loaded_model_state
-    try:
-        if loaded_model_state.get("model"):
-            logger.info("Clearing previously loaded model...")
-            del loaded_model_state["model"], loaded_model_state["processor"]
-            loaded_model_state.clear()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-
-        # Use the single model_id field, as per your models.py
-        actual_model_id = request.model_id
-        logger.info(f"Loading model for mode '{request.mode}': {actual_model_id}")
-
-        start_time = time.perf_counter()
-        model, processor = load_model(
-            mode=request.mode,
-            model_id=actual_model_id,
-            device=request.device,
-            precision=request.precision,
-            trust_remote_code=request.trust_remote_code,
-        )
-        load_time = time.perf_counter() - start_time
-
-        actual_device = "cpu"
-        effective_precision = request.precision
+    # Serialize loads so concurrent requests can't interleave writes to loaded_model_state,
+    # and let in-flight requests finish with the old model before it is dropped
+    async with model_load_lock, model_state_guard.write():
         try:
-            model_param = next(model.parameters())
-            actual_device = str(model_param.device)
-            if request.mode == "lfm2":
-                effective_precision = str(model_param.dtype).replace("torch.", "")
-        except StopIteration:
-            logger.warning("Model has no parameters, cannot determine device/dtype.")
-            actual_device = request.device
-
-        loaded_model_state.update(
-            {
-                "mode": request.mode,
-                "model": model,
-                "processor": processor,
-                "model_id": actual_model_id,
-                "device": actual_device,
-                "precision": effective_precision,
-            }
-        )
-
-        logger.info(f"Model loaded in {load_time:.2f}s. Effective precision: {effective_precision}")
-        return LoadModelResponse(
-            message=f"Model '{actual_model_id}' loaded in {load_time:.2f}s.",
-            mode=request.mode,
-            loaded_model_id=actual_model_id,
-            device=loaded_model_state["device"],
-            precision=effective_precision,
-        )
-    except Exception as e:
-        logger.exception(f"Failed to load model: {e}")
-        loaded_model_state.clear()
+            if loaded_model_state.model is not None:
+                logger.info("Clearing previously loaded model...")
+                # Keep freed blocks in the caching allocator for the next model instead of
+                # returning them to the driver; use /models/unload to trim explicitly.
+                loaded_model_state.reset()
+                gc.collect()
+
+            # Use the single model_id field, as per your models.py
+            actual_model_id = request.model_id
+            logger.info(f"Loading model for mode '{request.mode}': {actual_model_id}")
+
+            start_time = time.perf_counter()
+            # Weight loading blocks for seconds; run it off the event loop
+            model, processor = await asyncio.to_thread(
+                load_model,
+                mode=request.mode,
+                model_id=actual_model_id,
+                device=request.device,
+                precision=request.precision,
+                trust_remote_code=request.trust_remote_code,
+            )
+            load_time = time.perf_counter() - start_time
+
+            # load_model resolved device/dtype once; request handlers only read the cached strings
+            if model._cached_device is not None:
+                actual_device = str(model._cached_device)
+                actual_dtype = str(model._cached_dtype).replace("torch.", "")
+            else:
+                logger.warning("Model has no parameters, cannot determine device/dtype.")
+                actual_device = request.device
+                actual_dtype = None
+            effective_precision = actual_dtype if request.mode == "lfm2" and actual_dtype else request.precision
+
+            loaded_model_state.mode = request.mode
+            loaded_model_state.model = model
+            loaded_model_state.processor = processor
+            loaded_model_state.model_id = actual_model_id
+            loaded_model_state.device = actual_device
+            loaded_model_state.dtype = actual_dtype
+            loaded_model_state.precision = effective_precision
+
+            logger.info(f"Model loaded in {load_time:.2f}s. Effective precision: {effective_precision}")
+            return LoadModelResponse(
+                message=f"Model '{actual_model_id}' loaded in {load_time:.2f}s.",
+                mode=request.mode,
+                loaded_model_id=actual_model_id,
+                device=loaded_model_state.device,
+                precision=effective_precision,
+            )
+        except Exception as e:
+            logger.exception(f"Failed to load model: {e}")
+            loaded_model_state.reset()
+            gc.collect()
+            raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
+
+
+@router.post("/models/unload", response_model=UnloadModelResponse)
+async def api_unload_model():
+    """Unloads the current model and releases cached GPU memory back to the driver."""
+    # Same drain as /models/load: in-flight requests finish before the model is dropped
+    async with model_load_lock, model_state_guard.write():
+        if loaded_model_state.model is None:
+            return UnloadModelResponse(message="No model loaded.")
+
+        model_id = loaded_model_state.model_id
+        loaded_model_state.reset()
+        gc.collect()
         if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
+            await asyncio.to_thread(torch.cuda.empty_cache)
+        logger.info(f"Unloaded model '{model_id}'.")
+        return UnloadModelResponse(message=f"Model '{model_id}' unloaded.")
 
 
-@router.post("/predict", response_model=PredictionResponse)
+# The hot endpoints build their response model once and serialize it directly,
+# bypassing FastAPI's response_model re-validation; the schema is kept for OpenAPI.
+@router.post("/predict", response_model=None, responses={200: {"model": PredictionResponse}})
 async def api_predict(
     text_input: str | None = Body(None),
     audio_file: UploadFile | None = File(None),
-    state: dict[str, Any] = Depends(get_model_state),
+    state: ModelState = Depends(get_model_state),
 ):
     """Runs prediction with the loaded model."""
+    # text_shap never uses audio: release the spooled upload before doing anything else
+    if state.mode == "text_shap" and audio_file is not None:
+        logger.warning("Ignoring audio_file sent to text_shap mode.")
+        await audio_file.close()
+        audio_file = None
+
     preprocess_start_time = time.perf_counter()
     audio_data_tensor: torch.Tensor | None = None
     sample_rate: int | None = None
 
-    if state["mode"] == "lfm2" and audio_file:
+    if state.mode == "lfm2" and audio_file:
         try:
-            audio_bytes = await audio_file.read()
             target_sr = 24000
-            audio_data_tensor, sample_rate = preprocess_audio(audio_bytes, target_sr=target_sr)
+            # Decode from the spooled upload directly instead of reading it into memory first
+            audio_data_tensor, sample_rate = await asyncio.to_thread(preprocess_audio, audio_file.file, target_sr=target_sr)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to process audio file: {str(e)}")
         finally:
-            if audio_file:
-                await audio_file.close()
-    elif state["mode"] == "text_shap" and audio_file:
-        if audio_file:
             await audio_file.close()
 
     try:
         start_time = time.perf_counter()
-        if state["mode"] == "lfm2":
-            generated_text = run_lfm2_prediction(
-                text=text_input,
-                audio_tensor=audio_data_tensor,
-                sample_rate=sample_rate,
-                model=state["model"],
-                processor=state["processor"],
-            )
+        if state.mode == "lfm2":
+            async with inference_semaphore:
+                generated_text = await asyncio.to_thread(
+                    run_lfm2_prediction,
+                    text=text_input,
+                    audio_tensor=audio_data_tensor,
+                    sample_rate=sample_rate,
+                    model=state.model,
+                    processor=state.processor,
+                )
         else:  # text_shap mode
             if text_input is None:
                 raise HTTPException(status_code=400, detail="Text input is required for this mode.")
-            generated_text = run_text_shap_prediction(
-                text=text_input,
-                model=state["model"],
-                tokenizer=state["processor"],
-                model_device=state["device"],
+            # Concurrent text_shap requests are coalesced into one padded generate() call
+            generated_text = await text_prediction_batcher.submit(
+                text_input,
+                model=state.model,
+                tokenizer=state.processor,
+                model_device=state.device,
             )
 
         preprocess_time = time.perf_counter() - preprocess_start_time
@@ -146,33 +189,35 @@ async def api_predict(
         inference_time = time.perf_counter() - start_time
         logger.info(f"Inference completed in {inference_time:.4f} seconds.")
 
-        return PredictionResponse(generated_text=generated_text, inference_time_seconds=inference_time)
+        response = PredictionResponse(generated_text=generated_text, inference_time_seconds=inference_time)
+        return ORJSONResponse(response.model_dump(mode="json"))
     except Exception as e:
         logger.exception(f"Prediction failed: {e}")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
-@router.post("/explain/text", response_model=ExplainTextResponse)
-async def api_explain_text(request: ExplainTextRequest, state: dict[str, Any] = Depends(get_model_state)):
+@router.post("/explain/text", response_model=None, responses={200: {"model": ExplainTextResponse}})
+async def api_explain_text(request: ExplainTextRequest, state: ModelState = Depends(get_model_state)):
     """Runs text-based SHAP explanation."""
-    if state["mode"] != "text_shap":
+    if state.mode != "text_shap":
         raise HTTPException(status_code=400, detail="SHAP is only available in 'text_shap' mode.")
 
     start_time = time.perf_counter()
     try:
-        tokens, shap_values_list = explain_text(
-            text_input=request.text_input,
-            model_state=state,
-            max_evals=request.max_evals,
-        )
+        async with inference_semaphore:
+            tokens, shap_values_list = await asyncio.to_thread(
+                explain_text,
+                text_input=request.text_input,
+                model_state=state,
+                max_evals=request.max_evals,
+            )
         explanation_time = time.perf_counter() - start_time
         logger.info(f"Explanation completed in {explanation_time:.4f} seconds.")
 
-        return ExplainTextResponse(
-            tokens=tokens,
-            shap_values=[float(v) for v in shap_values_list],
-            explanation_time_seconds=explanation_time,
-        )
+        # Convert in one C-level pass when given an array; explain_text usually returns floats already
+        shap_values = shap_values_list.tolist() if hasattr(shap_values_list, "tolist") else list(map(float, shap_values_list))
+        response = ExplainTextResponse(tokens=tokens, shap_values=shap_values, explanation_time_seconds=explanation_time)
+        return ORJSONResponse(response.model_dump(mode="json"))
     except Exception as e:
         logger.exception(f"Text explanation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Text explanation failed: {str(e)}")
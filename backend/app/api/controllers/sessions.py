@@ -1,6 +1,8 @@
 import logging
+from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
@@ -30,12 +32,36 @@ async def create_session(*, session: SessionCreate, db: AsyncSession = Depends(g
 
 
 @router.get("/", response_model=list[SessionReadList])
-async def list_sessions(db: AsyncSession = Depends(get_session)):
+async def list_sessions(
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=500),
+    before: datetime | None = None,
+    before_id: int | None = None,
+    db: AsyncSession = Depends(get_session),
+):
     """
-    List all saved sessions (ID, name, and creation time only).
+    List saved sessions (ID, name, and creation time only), newest first.
+
+    Without `limit` every session is returned. With it, pages are keyed on (`created_at`, `id`):
+    pass the `X-Next-Before` and `X-Next-Before-Id` header values from the previous page as
+    `before` and `before_id` to fetch the next one. The headers are omitted on the last page.
     """
-    result = await db.execute(select(Session).order_by(Session.created_at.desc()))
-    sessions = result.scalars().all()
+    # Only fetch the sidebar columns; skip decoding the JSON settings/attributions blobs
+    stmt = select(Session.id, Session.name, Session.created_at)
+    if before is not None and before_id is not None:
+        # Tie-break on id so sessions sharing the boundary timestamp are neither skipped nor repeated
+        stmt = stmt.where(tuple_(Session.created_at, Session.id) < tuple_(before, before_id))
+    elif before is not None:
+        stmt = stmt.where(Session.created_at < before)
+    stmt = stmt.order_by(Session.created_at.desc(), Session.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    result = await db.execute(stmt)
+    sessions = [SessionReadList.model_validate(row) for row in result.mappings().all()]
+    if limit is not None and len(sessions) == limit:
+        response.headers["X-Next-Before"] = sessions[-1].created_at.isoformat()
+        response.headers["X-Next-Before-Id"] = str(sessions[-1].id)
     return sessions
 
 
@@ -1,8 +1,9 @@
 import logging
 import os
+from asyncio import current_task
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession, async_scoped_session, async_sessionmaker, create_async_engine
 from sqlmodel import SQLModel
 
 logger = logging.getLogger(__name__)
@@ -22,8 +23,35 @@ else:
 
 
 # Create the async engine
-# echo=True is good for dev, remove for prod
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# SQL echo is useful for dev but costly per query; opt in with SQL_ECHO=1
+SQL_ECHO = os.getenv("SQL_ECHO") == "1"
+# Keep a warm connection pool so bursts of session requests don't churn connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_OVERFLOW", 10))
+
+
+def _orjson_dumps(obj) -> str:
+    """JSON serializer for JSON/JSONB columns; the driver expects text, orjson returns bytes."""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    json_serializer=_orjson_dumps,
+    json_deserializer=orjson.loads,
+    echo=SQL_ECHO,
+    future=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+)
+
+# Session factory is built once at import, not per request
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# One session per asyncio task (i.e. per request), shared by any dependency or helper in that task
+ScopedSession = async_scoped_session(SessionLocal, scopefunc=current_task)
 
 
 async def create_db_and_tables():
@@ -38,8 +66,9 @@ async def create_db_and_tables():
 
 async def get_session() -> AsyncSession:
     """
-    FastAPI dependency to get a new database session for each request.
+    FastAPI dependency to get the database session for the current request.
     """
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    async with async_session() as session:
-        yield session
+    try:
+        yield ScopedSession()
+    finally:
+        await ScopedSession.remove()
@@ -0,0 +1,24 @@
+# backend/app/gunicorn_conf.py
+# Run with: gunicorn app.main:app -c app/gunicorn_conf.py
+#
+# NOTE: loaded_model_state lives in each worker process. With WEB_WORKERS > 1 every
+# worker must load its own copy of the model (POST /api/ml/models/load only reaches one
+# of them), and MAX_CONCURRENT_INFER applies per worker, not per GPU.
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class UvloopWorker(UvicornWorker):
+    """Uvicorn worker pinned to the uvloop event loop and httptools HTTP parser."""
+
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "loop": "uvloop", "http": "httptools"}
+
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_WORKERS", "1"))
+worker_class = "app.gunicorn_conf.UvloopWorker"
+# Model loads and SHAP runs are long; don't let the arbiter recycle busy workers too eagerly
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
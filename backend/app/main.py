@@ -1,10 +1,14 @@
 import logging
+import os
 from contextlib import asynccontextmanager
 
+import torch
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.api.api import api_router
+from app.api.controllers.ml import text_prediction_batcher
 from app.db import create_db_and_tables
 
 logging.basicConfig(
@@ -13,6 +17,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Let the CUDA caching allocator grow segments in place and limit fragmentation across model reloads.
+# Must be set before CUDA is first initialized.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:256")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -23,15 +31,21 @@ async def lifespan(app: FastAPI):
     logger.info("Initializing database...")
     await create_db_and_tables()
     logger.info("Database initialized.")
+    # Inference runs in worker threads, each wrapped in torch.inference_mode() by the services.
+    # Grad mode is thread-local, so only process-wide backend flags are set here.
+    if torch.cuda.is_available():
+        torch.backends.cudnn.benchmark = True
     yield
     # Run at shutdown
     logger.info("Application shutdown...")
+    await text_prediction_batcher.aclose()
 
 
 app = FastAPI(
     title="MLLM Shapley Value Explainer API",
     version="0.2.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -40,6 +54,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Before", "X-Next-Before-Id"],
 )
 
 
@@ -1,14 +1,20 @@
 # backend/app/models.py
 import logging
+from dataclasses import dataclass, replace
 from datetime import datetime
 from typing import Any, Literal
 
 from pydantic import BaseModel, Field
-from sqlmodel import JSON, Column, SQLModel
+from sqlalchemy import JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import Column, SQLModel
 from sqlmodel import Field as SQLModelField
 
 logger = logging.getLogger(__name__)
 
+# JSONB on Postgres; other dialects (SQLite in tests) fall back to plain JSON
+JSONDocument = JSON().with_variant(JSONB(), "postgresql")
+
 
 # --- Request Models ---
 class LoadModelRequest(BaseModel):
@@ -17,7 +23,7 @@ class LoadModelRequest(BaseModel):
     model_id: str = Field(..., description="Hugging Face model ID for LFM2 mode")
     mode: Literal["lfm2", "text_shap"] = Field("lfm2", description="Mode: 'lfm2' for LiquidAI model, 'text_shap' for SHAP demo text model.")
     device: str = Field("cuda", description="Device ('cuda', 'cpu', 'mps')")
-    precision: str = Field("float16", description="Precision ('float32', 'float16', 'bfloat16', 'int8') - Ignored for LFM2 mode.")
+    precision: str = Field("float16", description="Precision ('float32', 'float16', 'bfloat16', 'int8', 'nf4') - Ignored for LFM2 mode.")
     trust_remote_code: bool = Field(True, description="Trust remote code execution (required for some models like LFM2)")
 
 
@@ -39,6 +45,12 @@ class LoadModelResponse(BaseModel):
     precision: str  # Reports requested/used precision
 
 
+class UnloadModelResponse(BaseModel):
+    """Response after unloading a model."""
+
+    message: str
+
+
 class PredictionResponse(BaseModel):
     """Response containing the model's prediction."""
 
@@ -64,9 +76,9 @@ class SessionBase(SQLModel):
     text_input: str | None = None
 
     # Store complex objects as JSON in the database
-    model_settings: dict = SQLModelField(default={}, sa_column=Column(JSON))
-    method_settings: dict = SQLModelField(default={}, sa_column=Column(JSON))
-    attributions: dict = SQLModelField(default={}, sa_column=Column(JSON))
+    model_settings: dict = SQLModelField(default_factory=dict, sa_column=Column(JSONDocument))
+    method_settings: dict = SQLModelField(default_factory=dict, sa_column=Column(JSONDocument))
+    attributions: dict = SQLModelField(default_factory=dict, sa_column=Column(JSONDocument))
 
 
 class Session(SessionBase, table=True):
@@ -75,7 +87,7 @@ class Session(SessionBase, table=True):
     """
 
     id: int | None = SQLModelField(default=None, primary_key=True)
-    created_at: datetime = SQLModelField(default_factory=datetime.utcnow, nullable=False)
+    created_at: datetime = SQLModelField(default_factory=datetime.utcnow, nullable=False, index=True)
 
 
 class SessionCreate(SessionBase):
@@ -107,11 +119,33 @@ class SessionReadList(SQLModel):
 
 
 # --- Global State ---
-loaded_model_state: dict[str, Any] = {
-    "mode": None,
-    "model": None,
-    "processor": None,
-    "model_id": None,
-    "device": None,
-    "precision": None,  # Store requested/used precision
-}
+@dataclass(slots=True)
+class ModelState:
+    """
+    Holds the currently loaded model and its metadata.
+    """
+
+    mode: str | None = None
+    model: Any = None
+    processor: Any = None
+    model_id: str | None = None
+    device: str | None = None
+    dtype: str | None = None  # Parameter dtype observed at load time
+    precision: str | None = None  # Store requested/used precision
+
+    def reset(self) -> None:
+        """Drop the loaded model and clear all metadata."""
+        self.mode = None
+        self.model = None
+        self.processor = None
+        self.model_id = None
+        self.device = None
+        self.dtype = None
+        self.precision = None
+
+    def snapshot(self) -> "ModelState":
+        """Copy of the current fields, so a request keeps using the model it started with."""
+        return replace(self)
+
+
+loaded_model_state = ModelState()
@@ -0,0 +1,113 @@
+# backend/app/services/batching.py
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.services.inference import run_text_shap_prediction_batch
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _PendingPrediction:
+    """A single queued text_shap prediction awaiting a batch slot."""
+
+    text: str
+    model: Any
+    tokenizer: Any
+    model_device: str
+    future: asyncio.Future = field(repr=False)
+
+
+class TextPredictionBatcher:
+    """
+    Collects text_shap /predict requests that arrive within a short window and
+    runs them through the model as one padded generate() call.
+
+    Requests are grouped by model and by a coarse prompt-length bucket so that a
+    single long prompt doesn't force heavy padding onto many short ones.
+    """
+
+    def __init__(
+        self,
+        semaphore: asyncio.Semaphore,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        bucket_chars: int = 256,
+    ):
+        self.semaphore = semaphore
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.bucket_chars = bucket_chars
+        self._queue: asyncio.Queue[_PendingPrediction] = asyncio.Queue()
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, text: str, model: Any, tokenizer: Any, model_device: str) -> str:
+        """Queue a prompt and wait for its generated text."""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingPrediction(text, model, tokenizer, model_device, future))
+        return await future
+
+    async def aclose(self) -> None:
+        """Stop the background worker."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_s
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except TimeoutError:
+                    break
+
+            for group in self._group(pending):
+                await self._dispatch(group)
+
+    def _group(self, pending: list[_PendingPrediction]) -> list[list[_PendingPrediction]]:
+        groups: dict[tuple[int, int], list[_PendingPrediction]] = {}
+        for item in pending:
+            key = (id(item.model), len(item.text) // self.bucket_chars)
+            groups.setdefault(key, []).append(item)
+        return list(groups.values())
+
+    async def _dispatch(self, group: list[_PendingPrediction]) -> None:
+        live = [item for item in group if not item.future.done()]
+        if not live:
+            return
+
+        head = live[0]
+        logger.info(f"Dispatching text_shap batch of {len(live)} request(s).")
+        try:
+            async with self.semaphore:
+                results = await asyncio.to_thread(
+                    run_text_shap_prediction_batch,
+                    [item.text for item in live],
+                    model=head.model,
+                    tokenizer=head.tokenizer,
+                    model_device=head.model_device,
+                )
+        except Exception as e:
+            for item in live:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        for item, result in zip(live, results, strict=True):
+            if not item.future.done():
+                item.future.set_result(result)
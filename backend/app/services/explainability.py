@@ -1,38 +1,162 @@
 # backend/app/services/explainability.py
 import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
 from typing import Any
 
 import numpy as np
 import shap
 import torch
 
+from app.models import ModelState
+
 logger = logging.getLogger(__name__)
 
-# Cache for SHAP explainers
-explainer_cache: dict[str, Any] = {}
+# Cache for SHAP explainers: model -> {"<device>_<mode>": (explainer, predict_ctx)}. Keyed weakly on the
+# model object, so entries vanish with the model on unload/reload instead of pinning its weights.
+explainer_cache: weakref.WeakKeyDictionary[Any, dict[str, tuple[Any, dict[str, Any]]]] = weakref.WeakKeyDictionary()
+
+# Number of next-token probabilities explained per run; the remaining mass is returned as one extra output
+SHAP_TOP_K = int(os.getenv("SHAP_TOP_K", "256"))
+
+# What the predict fn returns per tracked token: "probs" (softmax, default) or "logits"
+# (max-shifted logits, skipping the softmax; attributions are then in logit units)
+SHAP_OUTPUT = os.getenv("SHAP_OUTPUT", "probs")
+
+# Placeholder used to split a rendered chat template into its prefix and suffix
+_TEXT_SENTINEL = "\ue000SHAP_TEXT\ue000"
+
+# Max distinct perturbations whose outputs are memoized per explainer
+SHAP_MEMO_SIZE = int(os.getenv("SHAP_MEMO_SIZE", "4096"))
+
+# Bounds for the forward-pass batch size used inside the SHAP predict fn
+SHAP_MIN_BATCH = int(os.getenv("SHAP_MIN_BATCH", "8"))
+SHAP_MAX_BATCH = int(os.getenv("SHAP_MAX_BATCH", "64"))
+
+
+def _last_token_logits(model: Any, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """Forward pass returning only the final position's logits."""
+    return model(input_ids=input_ids, attention_mask=attention_mask).logits[:, -1, :]
+
+
+# Optional torch.compile of the SHAP forward (SHAP_TORCH_COMPILE=1). Compilation happens lazily on
+# the first call; dynamic=True avoids recompiling for every perturbation batch/sequence length.
+_compiled_last_token_logits = (
+    torch.compile(_last_token_logits, dynamic=True) if os.getenv("SHAP_TORCH_COMPILE") == "1" and hasattr(torch, "compile") else None
+)
+
+
+def _join_token_lists(tokenizer: Any, token_lists: list[list[str]]) -> list[str]:
+    """
+    Batched convert_tokens_to_string. Fast tokenizers decode all lists in one Rust call;
+    lists with tokens outside the vocabulary (which would decode as unk) use the per-list path.
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is None:
+        return [tokenizer.convert_tokens_to_string(tokens) for tokens in token_lists]
+
+    unk_id = tokenizer.unk_token_id
+    id_lists = [tokenizer.convert_tokens_to_ids(tokens) for tokens in token_lists]
+    batchable = [
+        i for i, (tokens, ids) in enumerate(zip(token_lists, id_lists, strict=True)) if _ids_round_trip(tokens, ids, unk_id, tokenizer.unk_token)
+    ]
+
+    joined = [""] * len(token_lists)
+    for i, text in zip(batchable, backend.decode_batch([id_lists[i] for i in batchable], skip_special_tokens=False), strict=True):
+        joined[i] = text
+    for i in set(range(len(token_lists))).difference(batchable):
+        joined[i] = tokenizer.convert_tokens_to_string(token_lists[i])
+    return joined
+
+
+def _ids_round_trip(tokens: list[str], ids: list[int | None], unk_id: int | None, unk_token: str | None) -> bool:
+    """True if every token maps to its own vocabulary id (nothing collapsed to unk/None)."""
+    return all(i is not None and (i != unk_id or t == unk_token) for t, i in zip(tokens, ids, strict=True))
+
+
+def _leading_special_ids(tokenizer: Any) -> list[int]:
+    """The special ids the tokenizer itself puts before any text (e.g. [bos] for Llama), found by encoding a probe."""
+    with_special = tokenizer("a")["input_ids"]
+    plain = tokenizer("a", add_special_tokens=False)["input_ids"]
+    for i in range(len(with_special) - len(plain) + 1):
+        if with_special[i : i + len(plain)] == plain:
+            return with_special[:i]
+    return []
+
+
+def _prompt_affix_ids(tokenizer: Any, model: Any) -> tuple[list[int], list[int]]:
+    """
+    Returns the token ids placed before and after the user text in the explanation prompt.
+    The chat template is rendered once around a sentinel and split there.
+    """
+    prefix, suffix = "", ""
+    if hasattr(tokenizer, "apply_chat_template"):
+        messages = [{"role": "user", "content": _TEXT_SENTINEL}]
+        try:
+            rendered = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            if _TEXT_SENTINEL in rendered:
+                prefix, suffix = rendered.split(_TEXT_SENTINEL, 1)
+        except Exception:
+            pass  # Fallback: no template, use the raw text
+    elif "phi-2" in model.config.name_or_path:
+        prefix, suffix = "Instruct: ", "\nOutput:"
+
+    prefix_ids = tokenizer(prefix, add_special_tokens=False)["input_ids"] if prefix else []
+    # Everything is tokenized without special tokens, so restore the leading ones (BOS) the model expects,
+    # unless the rendered template already starts with them
+    bos_token = getattr(tokenizer, "bos_token", None)
+    if not (bos_token and prefix.startswith(bos_token)):
+        prefix_ids = _leading_special_ids(tokenizer) + prefix_ids
+    suffix_ids = tokenizer(suffix, add_special_tokens=False)["input_ids"] if suffix else []
+    logger.info(f"Cached prompt template ids: prefix={len(prefix_ids)} tokens, suffix={len(suffix_ids)} tokens.")
+    return prefix_ids, suffix_ids
 
 
 def explain_text(
     text_input: str,
-    model_state: dict[str, Any],  # Accepts the state dict
+    model_state: ModelState,
     max_evals: int,
 ) -> tuple[list[str], list[float]]:
     """
     Calculates SHAP values for standard text model input using the Partition explainer.
-    Explains the model's output probability distribution for the next token.
+    Explains the model's next-token probabilities for the top-K tokens of the
+    unmasked input (plus the remaining probability mass), or their max-shifted
+    logits when SHAP_OUTPUT=logits.
     """
     logger.info(f"Starting SHAP explanation for text: '{text_input[:50]}...' (max_evals={max_evals})")
+    return explain_text_batch([text_input], model_state, max_evals)[0]
 
-    # Unpack state
-    try:
-        model = model_state["model"]
-        tokenizer = model_state["processor"]
-        model_device = next(model.parameters()).device
-    except (KeyError, StopIteration) as e:
-        logger.error(f"Invalid model_state dictionary: {e}")
+
+def explain_text_batch(
+    texts: list[str],
+    model_state: ModelState,
+    max_evals: int,
+    shap_batch_size: int | str = "auto",
+) -> list[tuple[list[str], list[float]]]:
+    """
+    Explains several texts with one Partition explainer, returning (tokens, attributions) per text.
+    Partition still evaluates each text's masked rows on their own, `shap_batch_size` rows per
+    predict call ("auto" lets SHAP choose); nothing is batched across texts. Sharing the call
+    shares the explainer, the encode/predict caches and one set of top-K next tokens (the
+    highest-probability tokens across the unmasked inputs).
+    """
+    if not texts:
+        return []
+    logger.info(f"Starting batched SHAP explanation for {len(texts)} text(s) (max_evals={max_evals}, batch_size={shap_batch_size})")
+
+    # Unpack state (device was resolved once at load time)
+    model = model_state.model
+    tokenizer = model_state.processor
+    model_device = model_state.device
+    if model is None or tokenizer is None or model_device is None:
+        logger.error("Invalid model_state: model, processor or device is missing.")
         raise ValueError("Model state is incomplete or model has no parameters.")
 
     logger.info(f"Explain running on device: {model_device}")
+    if not getattr(tokenizer, "is_fast", False):
+        logger.warning("Tokenizer is not a fast (Rust) tokenizer; batch tokenization of SHAP perturbations will be slow.")
 
     if not hasattr(model, "config") or not hasattr(model.config, "model_type"):
         raise TypeError("Model does not have expected 'config.model_type' attribute.")
@@ -43,90 +167,198 @@ def explain_text(
         logger.error("Could not determine tokenizer vocab_size.")
         raise ValueError("vocab_size is None, cannot proceed with explanation.")
 
+    # The cached predict fn only holds the model weakly; a strong reference from the closure
+    # would keep the cache key alive forever
+    model_ref = weakref.ref(model)
+
+    # Mutable per-explainer context. 'output_ids' holds the top-K token ids of the unmasked
+    # input; while set, the predict fn returns only those probabilities plus the rest mass.
+    # 'memo' maps token id rows to their outputs for the current output_ids; 'encoded' maps
+    # texts to their ids and does not depend on output_ids, so it survives across runs.
+    predict_ctx: dict[str, Any] = {"output_ids": None, "memo": OrderedDict(), "encoded": OrderedDict(), "lock": threading.Lock()}
+
     # --- 1. Create Prediction Function (for standard text models) ---
+    def resolve_batch_size() -> int:
+        """Pick the forward-pass batch size once per explainer from free device memory."""
+        if predict_ctx.get("batch_size") is None:
+            if str(model_device).startswith("cuda"):
+                free_bytes, _ = torch.cuda.mem_get_info(torch.device(model_device))
+                # Worst case per row: fp32 logits for every position of a max-length prompt; keep half as headroom
+                per_row_bytes = 512 * vocab_size * 4
+                predict_ctx["batch_size"] = int(max(SHAP_MIN_BATCH, min(SHAP_MAX_BATCH, free_bytes // (2 * per_row_bytes))))
+            else:
+                predict_ctx["batch_size"] = SHAP_MAX_BATCH
+            logger.info(f"SHAP predict batch size set to {predict_ctx['batch_size']}.")
+        return predict_ctx["batch_size"]
+
+    def encode_texts(texts: list[str]) -> list[list[int]]:
+        """Tokenize only the variable text (skipping texts seen before) and wrap it in the cached template ids."""
+        prefix_ids, suffix_ids = predict_ctx["prefix_ids"], predict_ctx["suffix_ids"]
+        max_text_len = max(1, 512 - len(prefix_ids) - len(suffix_ids))
+        encoded: OrderedDict[str, list[int]] = predict_ctx["encoded"]
+        new_texts = list(dict.fromkeys(text for text in texts if text not in encoded))
+        if new_texts:
+            # Only ids are needed: masks are built from row lengths in pad_rows, and no padding is requested
+            new_ids = tokenizer(
+                new_texts,
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+                return_offsets_mapping=False,
+            )["input_ids"]
+            encoded.update(zip(new_texts, new_ids, strict=True))
+
+        rows = [prefix_ids + encoded[text][:max_text_len] + suffix_ids for text in texts]
+        for text in texts:
+            encoded.move_to_end(text)
+        while len(encoded) > SHAP_MEMO_SIZE:
+            encoded.popitem(last=False)
+        return rows
+
+    def pad_rows(rows: list[tuple[int, ...]]) -> tuple[torch.Tensor, torch.Tensor]:
+        """Left-pad token id rows into input_ids/attention_mask on the model device."""
+        seq_len = max(len(row) for row in rows)
+        input_ids = torch.full((len(rows), seq_len), predict_ctx["pad_token_id"], dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), seq_len), dtype=torch.long)
+        for i, row in enumerate(rows):
+            input_ids[i, seq_len - len(row) :] = torch.tensor(row, dtype=torch.long)
+            attention_mask[i, seq_len - len(row) :] = 1
+        return input_ids.to(model_device), attention_mask.to(model_device)
+
+    def score_rows(rows: list[tuple[int, ...]]) -> torch.Tensor:
+        """Run one forward pass over a single chunk of token id rows; result stays on device."""
+        input_ids, attention_mask = pad_rows(rows)
+        model = model_ref()
+        if model is None:
+            raise RuntimeError("Model was unloaded while its SHAP explainer was in use.")
+
+        # inference_mode is thread-local, so it is entered here (in the to_thread worker), not by the caller
+        with torch.inference_mode():
+            if _compiled_last_token_logits is not None:
+                last_token_logits = _compiled_last_token_logits(model, input_ids, attention_mask)
+            else:
+                outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+                if not hasattr(outputs, "logits"):
+                    raise ValueError("Model output object has no 'logits' attribute.")
+
+                # e.g., [batch, 51200]
+                last_token_logits = outputs.logits[:, -1, :]
+
+            # --- FIX: Truncate logits to match tokenizer vocab size ---
+            # Check if the model's logit dim is larger than the tokenizer's vocab size
+            if last_token_logits.shape[-1] > vocab_size:  # 51200 > 50257 (True)
+                logger.debug(f"Model logits dim ({last_token_logits.shape[-1]}) > tokenizer vocab_size ({vocab_size}). Truncating logits.")
+                # Truncate the logits *before* softmax
+                last_token_logits = last_token_logits[:, :vocab_size]  # Shape is now [batch, 50257]
+
+            elif last_token_logits.shape[-1] < vocab_size:
+                # This should not happen, but safeguard
+                logger.warning(f"Model logits dim ({last_token_logits.shape[-1]}) < tokenizer vocab_size ({vocab_size}). Padding logits with zeros.")
+                pad_width = vocab_size - last_token_logits.shape[-1]
+                last_token_logits = torch.nn.functional.pad(last_token_logits, (0, pad_width), "constant", 0)
+            # --- END FIX ---
+
+            output_ids = predict_ctx["output_ids"]
+            if SHAP_OUTPUT == "logits":
+                # Explain max-shifted logits directly: no exp/normalize over the vocabulary. [batch, K]
+                row_max = last_token_logits.max(dim=-1, keepdim=True).values.float()
+                selected = last_token_logits if output_ids is None else last_token_logits.index_select(-1, output_ids)
+                probs = selected.float() - row_max
+            else:
+                # Now softmax will produce shape [batch, 50257]. Run it in the model's dtype to halve
+                # bandwidth on bf16/fp16 models; fp16 accumulates in fp32 inside the kernel for stability.
+                softmax_dtype = torch.float32 if last_token_logits.dtype == torch.float16 else None
+                probs = torch.softmax(last_token_logits, dim=-1, dtype=softmax_dtype)
+
+                if output_ids is not None:
+                    # Keep only the tracked top-K tokens plus the leftover mass: [batch, K + 1].
+                    # Only these K columns are upcast, so the rest-mass subtraction stays precise.
+                    top_probs = probs.index_select(-1, output_ids).float()
+                    rest = (1.0 - top_probs.sum(dim=-1, keepdim=True)).clamp_min_(0.0)
+                    probs = torch.cat([top_probs, rest], dim=-1)
+
+        return probs
+
+    def to_host(outputs: torch.Tensor) -> np.ndarray:
+        """Copy predict outputs to a NumPy array, staging CUDA results through a reused pinned buffer."""
+        if not outputs.is_cuda:
+            # Upcast (if still needed) after the D2H copy, not before
+            return outputs.cpu().float().numpy()
+
+        pinned = predict_ctx.get("pinned_out")
+        if pinned is None or pinned.numel() < outputs.numel():
+            pinned = torch.empty(outputs.numel(), dtype=torch.float32, pin_memory=True)
+            predict_ctx["pinned_out"] = pinned
+        staged = pinned[: outputs.numel()].view(outputs.shape)
+        staged.copy_(outputs, non_blocking=True)
+        torch.cuda.current_stream(outputs.device).synchronize()
+        # SHAP keeps the returned array, so hand back an owned copy rather than a view of the buffer
+        return staged.numpy().copy()
+
     def model_predict_next_token_prob(texts: list[Any]):  # Can receive List[str] or List[List[str]]
         """
         Prediction function for standard HF text models.
-        Closes over 'model', 'tokenizer', 'model_device', and 'vocab_size'.
+        Closes over 'model_ref', 'tokenizer', 'model_device', 'vocab_size' and 'predict_ctx'.
         """
 
         # Handle list-of-tokens input from SHAP masker
         processed_texts: list[str] = []
+        token_list_positions: list[int] = []
         for item in texts:
             if isinstance(item, list):
-                # Join list of tokens back into a single string
-                processed_texts.append(tokenizer.convert_tokens_to_string(item))
+                token_list_positions.append(len(processed_texts))
+                processed_texts.append("")  # Filled in below
             elif isinstance(item, str):
                 processed_texts.append(item)
             else:
                 processed_texts.append(str(item))
 
-        # Apply chat template (or prefix) to SHAP inputs
-        formatted_prompts: list[str] = []
-        for text in processed_texts:
-            if hasattr(tokenizer, "apply_chat_template"):
-                messages = [{"role": "user", "content": text}]
-                try:
-                    prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-                    formatted_prompts.append(prompt)
-                except Exception:
-                    formatted_prompts.append(text)  # Fallback
-            elif "phi-2" in model.config.name_or_path:
-                formatted_prompts.append(f"Instruct: {text}\nOutput:")
-            else:
-                formatted_prompts.append(text)  # Default
+        if token_list_positions:
+            # Join lists of tokens back into strings in one batched call
+            joined = _join_token_lists(tokenizer, [texts[i] for i in token_list_positions])
+            for i, text in zip(token_list_positions, joined, strict=True):
+                processed_texts[i] = text
 
+        # The chat template (or prefix) is applied as cached token ids in encode_texts
         try:
-            current_padding_side = tokenizer.padding_side
-            tokenizer.padding_side = "left"
-            if tokenizer.pad_token is None:
-                if tokenizer.eos_token is not None:
-                    tokenizer.pad_token = tokenizer.eos_token
-                else:
-                    tokenizer.pad_token = 0
-
-            inputs = tokenizer(formatted_prompts, return_tensors="pt", padding=True, truncation=True, max_length=512).to(model_device)
-            tokenizer.padding_side = current_padding_side
-
-            with torch.no_grad():
-                outputs = model(**inputs)
-                if not hasattr(outputs, "logits"):
-                    raise ValueError("Model output object has no 'logits' attribute.")
-
-                # e.g., [batch, 51200]
-                last_token_logits = outputs.logits[:, -1, :]
-
-                # --- FIX: Truncate logits to match tokenizer vocab size ---
-                # Check if the model's logit dim is larger than the tokenizer's vocab size
-                if last_token_logits.shape[-1] > vocab_size:  # 51200 > 50257 (True)
-                    logger.debug(f"Model logits dim ({last_token_logits.shape[-1]}) > tokenizer vocab_size ({vocab_size}). Truncating logits.")
-                    # Truncate the logits *before* softmax
-                    last_token_logits = last_token_logits[:, :vocab_size]  # Shape is now [batch, 50257]
-
-                elif last_token_logits.shape[-1] < vocab_size:
-                    # This should not happen, but safeguard
-                    logger.warning(
-                        f"Model logits dim ({last_token_logits.shape[-1]}) < tokenizer vocab_size ({vocab_size}). Padding logits with zeros."
-                    )
-                    pad_width = vocab_size - last_token_logits.shape[-1]
-                    last_token_logits = torch.nn.functional.pad(last_token_logits, (0, pad_width), "constant", 0)
-                # --- END FIX ---
-
-                # Now softmax will produce shape [batch, 50257]
-                probs = torch.softmax(last_token_logits, dim=-1)
-
-            return probs.cpu().float().numpy()
+            rows = [tuple(row) for row in encode_texts(processed_texts)]
+
+            # SHAP re-evaluates many identical coalitions; only run the model on rows not seen yet
+            memo: OrderedDict[tuple[int, ...], np.ndarray] = predict_ctx["memo"]
+            misses = list(dict.fromkeys(row for row in rows if row not in memo))
+            if misses:
+                # Score in model-sized chunks rather than whatever batch size SHAP hands us
+                batch_size = resolve_batch_size()
+                chunks = [score_rows(misses[i : i + batch_size]) for i in range(0, len(misses), batch_size)]
+                for row, result in zip(misses, to_host(torch.cat(chunks, dim=0)), strict=True):
+                    memo[row] = result
+            logger.debug(f"SHAP predict batch: {len(rows)} rows, {len(misses)} model evaluations.")
+
+            outputs = np.stack([memo[row] for row in rows])
+            for row in rows:
+                memo.move_to_end(row)
+            while len(memo) > SHAP_MEMO_SIZE:
+                memo.popitem(last=False)
+            return outputs
 
         except Exception:
-            logger.exception(f"Error in SHAP prediction function on input: {formatted_prompts[0] if formatted_prompts else '[]'}")
-            batch_size = len(formatted_prompts)
-            # This return shape MUST match the tokenizer's vocab_size
-            return np.zeros((batch_size, vocab_size))
+            logger.exception(f"Error in SHAP prediction function on input: {processed_texts[0] if processed_texts else '[]'}")
+            batch_size = len(processed_texts)
+            # This return shape MUST match the number of outputs the explainer sees
+            output_ids = predict_ctx["output_ids"]
+            if output_ids is None:
+                num_outputs = vocab_size
+            else:
+                num_outputs = output_ids.numel() + (0 if SHAP_OUTPUT == "logits" else 1)
+            return np.zeros((batch_size, num_outputs))
+
+    predict_ctx["predict"] = model_predict_next_token_prob
 
     # --- 2. Create SHAP Explainer ---
-    explainer_key = f"{model.config.model_type}_{model_device}_partition_text_shap"
+    model_explainers = explainer_cache.setdefault(model, {})
+    explainer_key = f"{model_device}_partition_text_shap"
 
-    if explainer_key not in explainer_cache:
+    if explainer_key not in model_explainers:
         logger.info("Creating new SHAP Partition explainer for text_shap...")
 
         if tokenizer.pad_token is None:
@@ -135,99 +367,51 @@ def explain_text(
             else:
                 tokenizer.pad_token = 0
 
+        # Tokenizer settings are fixed here, once per explainer, never inside the predict fn
+        predict_ctx["pad_token_id"] = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+
+        # Render the prompt wrapper once; each perturbation only tokenizes its own text
+        predict_ctx["prefix_ids"], predict_ctx["suffix_ids"] = _prompt_affix_ids(tokenizer, model)
+
         masker = shap.maskers.Text(tokenizer=tokenizer)
 
-        # output_names=None is critical to prevent the IndexError
+        # output_names=None is critical to prevent the IndexError; outputs are positional
+        # (top-K token probabilities, then the rest mass), so no names are materialized
         output_names = None
-        logger.info("Setting output_names=None to support full vocabulary (prevents IndexError).")
+        logger.info("Setting output_names=None; outputs are the tracked top-K tokens (prevents IndexError).")
 
         explainer = shap.Explainer(
             model_predict_next_token_prob,
             masker,
             output_names=output_names,  # Pass None
         )
-        explainer_cache[explainer_key] = explainer
+        model_explainers[explainer_key] = (explainer, predict_ctx)
         logger.info("SHAP explainer created and cached.")
     else:
         logger.info("Using cached SHAP explainer.")
-        explainer = explainer_cache[explainer_key]
+        explainer, predict_ctx = model_explainers[explainer_key]
 
     # --- 3. Calculate SHAP values ---
     try:
-        logger.info(f"Calculating SHAP values for input: '{text_input}'")
-        shap_values = explainer([text_input], max_evals=max_evals)
-        logger.info("SHAP values calculated.")
-
-        # --- 4. Process SHAP Values ---
-        shap_values_array = shap_values.values
-        if not isinstance(shap_values_array, np.ndarray):
-            raise TypeError(f"SHAP values are not a numpy array: {type(shap_values_array)}")
-
-        logger.debug(f"Raw SHAP values shape: {shap_values_array.shape}")
-
-        token_attributions_np = None
-        # Sum absolute attributions across the output vocabulary dimension (axis=-1)
-        if shap_values_array.ndim == 3 and shap_values_array.shape[0] == 1:
-            # Standard case: [batch_size, num_tokens, num_output_classes] = [1, N, V]
-            token_attributions_np = np.abs(shap_values_array[0]).sum(axis=-1)
-        elif shap_values_array.ndim == 2:
-            # Check if it's [N, V]
-            if hasattr(shap_values, "data") and shap_values.data is not None and len(shap_values.data[0]) == shap_values_array.shape[0]:
-                # Fallback: [num_tokens, num_output_classes] = [N, V]
-                logger.warning("SHAP values shape is [N_tokens, N_outputs]. Summing over outputs.")
-                token_attributions_np = np.abs(shap_values_array).sum(axis=-1)
-            # Check if it's [1, N]
-            elif shap_values_array.shape[0] == 1:
-                # Fallback: [batch_size, num_tokens] = [1, N]
-                logger.warning("SHAP values shape is [1, N_tokens]. Using absolute values directly.")
-                token_attributions_np = np.abs(shap_values_array[0])
-
-        if token_attributions_np is None:
-            # If shape is still unexpected, raise an error
-            raise ValueError(f"Unexpected SHAP values shape: {shap_values_array.shape}")
-
-        token_attributions = [float(v) for v in token_attributions_np]
-
-        # --- 5. Get Tokens ---
-        raw_tokens = None
-        if hasattr(shap_values, "data") and isinstance(shap_values.data, np.ndarray) and shap_values.data.shape[0] == 1:
-            raw_tokens = shap_values.data[0].tolist()
-            tokens = [str(t) for t in raw_tokens]
-            logger.info(f"Retrieved {len(tokens)} tokens from shap_values.data.")
-        else:
-            logger.warning("Could not retrieve tokens from SHAP object. Re-tokenizing.")
-            encoded = tokenizer(text_input, add_special_tokens=False)
-            tokens = tokenizer.convert_ids_to_tokens(encoded["input_ids"])
-            raw_tokens = tokens  # Use this as the fallback
-
-        # --- 6. Final Alignment and Cleanup ---
-        # Filter out empty tokens that the masker might produce
-        valid_indices = [i for i, token in enumerate(tokens) if token and str(token).strip() != ""]
-
-        if len(valid_indices) < len(tokens):
-            logger.info(f"Filtering {len(tokens) - len(valid_indices)} empty/whitespace tokens.")
-            tokens_filtered = [tokens[i] for i in valid_indices]
-            if len(valid_indices) <= len(token_attributions):
-                token_attributions_filtered = [token_attributions[i] for i in valid_indices]
-                tokens = tokens_filtered
-                token_attributions = token_attributions_filtered
-            else:
-                logger.error("Token/attribution mismatch after filtering empty tokens. Aborting filtering.")
-                tokens = [str(t) for t in raw_tokens]  # Revert
-                token_attributions = [float(v) for v in token_attributions_np]  # Revert
-
-        num_tokens = len(tokens)
-        num_attrs = len(token_attributions)
-
-        if num_tokens != num_attrs:
-            logger.error(f"Final token ({num_tokens}) and attribution ({num_attrs}) count mismatch! Forcing alignment.")
-            min_len = min(num_tokens, num_attrs)
-            tokens = tokens[:min_len]
-            token_attributions = token_attributions[:min_len]
-
-        logger.info(f"Token attributions: {token_attributions[:10]}... (total {len(token_attributions)})")
-        logger.info(f"Explanation complete. Final Tokens: {len(tokens)}, Attributions: {len(token_attributions)}")
-        return tokens, token_attributions
+        # predict_ctx (output_ids, memo, encode cache, pinned buffer) is shared by every run of this
+        # explainer; with MAX_CONCURRENT_INFER > 1, runs on the same model must not interleave
+        with predict_ctx["lock"]:
+            # Pick the top-K next tokens of the unmasked inputs once; every perturbation is then
+            # scored on the same K outputs instead of the full vocabulary.
+            predict_ctx["output_ids"] = None
+            predict_ctx["memo"].clear()
+            reference_probs = torch.from_numpy(predict_ctx["predict"](texts)).amax(dim=0)
+            top_k = min(SHAP_TOP_K, reference_probs.shape[-1])
+            predict_ctx["output_ids"] = torch.topk(reference_probs, k=top_k).indices.to(model_device)
+            predict_ctx["memo"].clear()
+            logger.debug(f"Tracking top-{top_k} next-token ids: {predict_ctx['output_ids'].tolist()}")
+
+            logger.info(f"Calculating SHAP values for {len(texts)} input(s): '{texts[0]}'")
+            shap_values = explainer(texts, max_evals=max_evals, batch_size=shap_batch_size)
+            logger.info("SHAP values calculated.")
+
+        # --- 4. Split along the leading batch axis ---
+        return [_row_attributions(shap_values[i], text, tokenizer) for i, text in enumerate(texts)]
 
     except ImportError as e:
         logger.error(f"Import error during SHAP calculation (likely missing dependency): {e}")
@@ -235,3 +419,63 @@ def explain_text(
     except Exception as e:
         logger.exception(f"Error during SHAP text explanation: {e}")
         raise RuntimeError(f"Failed to explain text: {e}")
+
+
+def _row_attributions(row: Any, text_input: str, tokenizer: Any) -> tuple[list[str], list[float]]:
+    """Reduces one text's SHAP explanation to per-token attributions aligned with its tokens."""
+    # --- Process SHAP Values ---
+    shap_values_array = row.values
+    if not isinstance(shap_values_array, np.ndarray):
+        raise TypeError(f"SHAP values are not a numpy array: {type(shap_values_array)}")
+
+    logger.debug(f"Raw SHAP values shape: {shap_values_array.shape}")
+
+    # Sum absolute attributions across the output dimension (axis=-1). The SHAP array is
+    # not used after this, so abs() is taken in place to avoid an [N, outputs] temporary.
+    if shap_values_array.ndim == 2:
+        # Standard case: [num_tokens, num_output_classes] = [N, V]
+        token_attributions_np = np.abs(shap_values_array, out=shap_values_array).sum(axis=-1)
+    elif shap_values_array.ndim == 1:
+        # Fallback: single output, [num_tokens] = [N]
+        logger.warning("SHAP values shape is [N_tokens]. Using absolute values directly.")
+        token_attributions_np = np.abs(shap_values_array)
+    else:
+        # If shape is still unexpected, raise an error
+        raise ValueError(f"Unexpected SHAP values shape: {shap_values_array.shape}")
+
+    token_attributions = token_attributions_np.tolist()  # C-level conversion to Python floats
+
+    # --- Get Tokens ---
+    # The API returns the tokenizer's own pieces (e.g. 'Ġqu'), not the masker's decoded strings in row.data
+    encoded = tokenizer(text_input, add_special_tokens=False)
+    tokens = tokenizer.convert_ids_to_tokens(encoded["input_ids"])
+    raw_tokens = tokens
+
+    # --- Final Alignment and Cleanup ---
+    # Filter out empty tokens that the masker might produce
+    valid_indices = [i for i, token in enumerate(tokens) if token and str(token).strip() != ""]
+
+    if len(valid_indices) < len(tokens):
+        logger.info(f"Filtering {len(tokens) - len(valid_indices)} empty/whitespace tokens.")
+        tokens_filtered = [tokens[i] for i in valid_indices]
+        if len(valid_indices) <= len(token_attributions):
+            token_attributions_filtered = [token_attributions[i] for i in valid_indices]
+            tokens = tokens_filtered
+            token_attributions = token_attributions_filtered
+        else:
+            logger.error("Token/attribution mismatch after filtering empty tokens. Aborting filtering.")
+            tokens = list(map(str, raw_tokens))  # Revert
+            token_attributions = token_attributions_np.tolist()  # Revert
+
+    num_tokens = len(tokens)
+    num_attrs = len(token_attributions)
+
+    if num_tokens != num_attrs:
+        logger.error(f"Final token ({num_tokens}) and attribution ({num_attrs}) count mismatch! Forcing alignment.")
+        min_len = min(num_tokens, num_attrs)
+        tokens = tokens[:min_len]
+        token_attributions = token_attributions[:min_len]
+
+    logger.info(f"Token attributions: {token_attributions[:10]}... (total {len(token_attributions)})")
+    logger.info(f"Explanation complete. Final Tokens: {len(tokens)}, Attributions: {len(token_attributions)}")
+    return tokens, token_attributions
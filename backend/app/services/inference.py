@@ -1,40 +1,154 @@
 # backend/app/services/inference.py
-import io
 import logging
-from typing import Any
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, BinaryIO
 
-import librosa
 import numpy as np
 import soundfile as sf
 import torch
 from liquid_audio import ChatState  # Import LFM2 specifics
+from transformers import DynamicCache
 
 logger = logging.getLogger(__name__)
 
+# soxr is the resampler; librosa (much slower, and heavy to import) is only a fallback for environments without it
+try:
+    import soxr
+except ImportError:
+    soxr = None
+    import librosa
+
+    logger.warning("soxr is not installed; falling back to librosa for audio resampling.")
+
+# Fixed system turn for ASR requests. Its encoding is a handful of tokens, so it is rebuilt per ChatState;
+# generate_sequential takes no past-KV input, so the prefill of this prefix cannot be reused across requests.
+ASR_SYSTEM_PROMPT = "Perform ASR."
+
+# Generation budget for LFM2; also sizes the on-device text token buffer
+LFM2_MAX_NEW_TOKENS = 256
+
+# Text tokens between early-stop checks in the LFM2 loop; each check is one device sync
+LFM2_EOS_CHECK_INTERVAL = max(1, int(os.getenv("LFM2_EOS_CHECK_INTERVAL", "8")))
+# Optional cap on generated characters (0 disables), checked at the same interval
+LFM2_MAX_CHARS = int(os.getenv("LFM2_MAX_CHARS", "0"))
+
+# Longest audio upload accepted, checked against the header before anything is decoded
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "60"))
+
+# Per-thread page-locked staging buffers for LFM2 audio; grown on demand, reused across requests
+_pinned_audio = threading.local()
+
+# Prompt KV caches kept per text_shap model for single-prompt generate() calls (0 disables). Each entry
+# holds a full prompt's keys/values on the model device, so keep this small.
+TEXT_PREFIX_CACHE_SIZE = int(os.getenv("TEXT_PREFIX_CACHE_SIZE", "4"))
+# Shortest shared prefix (in tokens) worth copying out of the cache
+TEXT_PREFIX_MIN_REUSE = int(os.getenv("TEXT_PREFIX_MIN_REUSE", "16"))
+
+# model -> LRU of prompt token ids -> DynamicCache of that prompt; None marks a model whose cache type isn't supported
+_prefix_caches: weakref.WeakKeyDictionary[Any, OrderedDict[tuple[int, ...], Any] | None] = weakref.WeakKeyDictionary()
+_prefix_cache_lock = threading.Lock()
 
-def preprocess_audio(audio_bytes: bytes, target_sr: int) -> tuple[torch.Tensor, int]:
-    """Load and preprocess audio bytes to a torch.Tensor (mono, target_sr, float32)."""
-    try:
-        # Read directly as float32
-        audio_data, sample_rate = sf.read(io.BytesIO(audio_bytes), dtype="float32")
 
-        # Ensure mono channel
-        if audio_data.ndim > 1:
-            audio_data = np.mean(audio_data, axis=1)
+def _empty_audio_tensor(num_samples: int) -> torch.Tensor:
+    """Allocate a float32 CPU tensor for samples, page-locked when CUDA is available."""
+    return torch.empty(num_samples, dtype=torch.float32, pin_memory=torch.cuda.is_available())
+
+
+def _resample(audio_data: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """Resample mono float32 audio with soxr, or librosa when soxr is unavailable."""
+    if soxr is not None:
+        return soxr.resample(audio_data, orig_sr, target_sr, quality="HQ")
+    return librosa.resample(y=audio_data, orig_sr=orig_sr, target_sr=target_sr)
+
+
+def preprocess_audio(audio_file: BinaryIO, target_sr: int) -> tuple[torch.Tensor, int]:
+    """Load and preprocess an audio file object to a torch.Tensor (mono, target_sr, float32)."""
+    try:
+        with sf.SoundFile(audio_file) as f:
+            sample_rate = f.samplerate
+            channels = f.channels
+            max_frames = int(MAX_AUDIO_SECONDS * sample_rate)
+            if f.frames > max_frames:
+                raise ValueError(f"Audio is {f.frames / sample_rate:.1f}s long; the limit is {MAX_AUDIO_SECONDS:g}s.")
+
+            if channels == 1 and sample_rate == target_sr and f.frames > 0:
+                # Fast path: decode straight into the (pinned) output tensor, no intermediate arrays
+                audio_tensor = _empty_audio_tensor(f.frames)
+                num_read = len(f.read(dtype="float32", out=audio_tensor.numpy()))
+                return audio_tensor[:num_read].unsqueeze(0), sample_rate
+
+            # Decode straight from the file object as float32. With a known length, soundfile writes into
+            # the NumPy view of a torch buffer, so everything below stays in torch without wrapping arrays.
+            if f.frames > 0:
+                frames = torch.empty((f.frames, channels), dtype=torch.float32)
+                frames = frames[: len(f.read(dtype="float32", out=frames.numpy(), always_2d=True))]
+            else:
+                # Length unknown from the header: read at most one frame past the limit to detect overruns
+                frames = torch.from_numpy(f.read(frames=max_frames + 1, dtype="float32", always_2d=True))
+                if frames.shape[0] > max_frames:
+                    raise ValueError(f"Audio is longer than the {MAX_AUDIO_SECONDS:g}s limit.")
+
+        num_frames = frames.shape[0]
+        needs_resample = sample_rate != target_sr
+
+        # Ensure mono channel. Without resampling, the mix is written straight into the output tensor.
+        audio_tensor = None if needs_resample else _empty_audio_tensor(num_frames)
+        if channels == 1 and needs_resample:
+            mono = frames[:, 0]
+        else:
+            mono = audio_tensor if audio_tensor is not None else torch.empty(num_frames, dtype=torch.float32)
+            if channels == 1:
+                mono.copy_(frames[:, 0])
+            else:
+                # Mix as one matrix-vector product against equal channel weights, straight into the output
+                mix = torch.full((channels,), 1.0 / channels, dtype=torch.float32)
+                torch.mv(frames, mix, out=mono)
 
         # Resample if necessary
-        if sample_rate != target_sr:
+        if needs_resample:
             logger.info(f"Resampling audio from {sample_rate} Hz to {target_sr} Hz.")
-            audio_data = librosa.resample(y=audio_data, orig_sr=sample_rate, target_sr=target_sr)
+            resampled = _resample(mono.numpy(), sample_rate, target_sr)
             sample_rate = target_sr
+            # Return float32 tensor (pinned when CUDA is available, so LFM2 needn't re-stage it)
+            audio_tensor = _empty_audio_tensor(resampled.shape[0])
+            audio_tensor.copy_(torch.from_numpy(resampled))
 
-        # Return float32 tensor
-        return torch.from_numpy(audio_data).unsqueeze(0), sample_rate
+        return audio_tensor.unsqueeze(0), sample_rate
     except Exception as e:
         logger.exception(f"Error processing audio: {e}")
         raise ValueError(f"Could not process audio file: {e}")
 
 
+def _stage_audio_pinned(audio_tensor: torch.Tensor) -> torch.Tensor:
+    """Copy audio into a reusable pinned host buffer so later H2D transfers can DMA directly."""
+    if not torch.cuda.is_available() or audio_tensor.is_pinned():
+        return audio_tensor
+
+    flat = audio_tensor.reshape(-1)
+    buf = getattr(_pinned_audio, "buf", None)
+    if buf is None or buf.numel() < flat.numel():
+        buf = torch.empty(flat.numel(), dtype=torch.float32, pin_memory=True)
+        _pinned_audio.buf = buf
+
+    staged = buf[: flat.numel()]
+    staged.copy_(flat)
+    return staged.view(audio_tensor.shape)
+
+
+def _lfm2_should_stop(token_ids: torch.Tensor, num_tokens: int, eos_id: int | None, text_tokenizer: Any) -> bool:
+    """True once the latest window of buffered text tokens holds EOS, or the decoded text reaches LFM2_MAX_CHARS."""
+    window = token_ids[max(0, num_tokens - LFM2_EOS_CHECK_INTERVAL) : num_tokens]
+    if eos_id is not None and bool((window == eos_id).any()):
+        return True
+    if LFM2_MAX_CHARS > 0:
+        return len(text_tokenizer.decode(token_ids[:num_tokens].tolist(), skip_special_tokens=True)) >= LFM2_MAX_CHARS
+    return False
+
+
+@torch.inference_mode()
 def run_lfm2_prediction(
     text: str | None,
     audio_tensor: torch.Tensor | None,  # Expect float32 tensor
@@ -43,11 +157,14 @@ def run_lfm2_prediction(
     processor: Any,  # LFM2AudioProcessor
 ) -> str:
     """Runs prediction using LFM2, choosing the correct generation method based on inputs."""
-    model_device = next(model.parameters()).device
+    # Resolved once by load_model; no per-request walk over the parameters
+    model_device = model._cached_device
     logger.info(f"Model is on device: {model_device}. Preparing inputs for LFM2 prediction.")
 
+    if audio_tensor is not None:
+        audio_tensor = _stage_audio_pinned(audio_tensor)
+
     chat = ChatState(processor)
-    generated_token_ids = []
 
     try:
         # Determine mode based on inputs provided
@@ -57,11 +174,11 @@ def run_lfm2_prediction(
             # --- ASR MODE ---
             logger.info("Using ASR mode with generate_sequential.")
             chat.new_turn("system")
-            chat.add_text("Perform ASR.")  # System prompt for ASR
+            chat.add_text(ASR_SYSTEM_PROMPT)  # System prompt for ASR
             chat.end_turn()
 
             chat.new_turn("user")
-            chat.add_audio(audio_tensor.cpu(), sample_rate)  # Audio input on CPU
+            chat.add_audio(audio_tensor, sample_rate)  # Audio input on (pinned) CPU
             chat.end_turn()
 
             chat.new_turn("assistant")
@@ -69,7 +186,7 @@ def run_lfm2_prediction(
             # Use generate_sequential for ASR
             generation_iterator = model.generate_sequential(
                 **chat,  # Pass ChatState directly
-                max_new_tokens=256,
+                max_new_tokens=LFM2_MAX_NEW_TOKENS,
             )
             logger.info("Starting LFM2 sequential generation (ASR)...")
 
@@ -80,7 +197,7 @@ def run_lfm2_prediction(
             chat.new_turn("user")
             # Add audio first if present, then text
             if audio_tensor is not None:
-                chat.add_audio(audio_tensor.cpu(), sample_rate)
+                chat.add_audio(audio_tensor, sample_rate)
             if text:
                 chat.add_text(text)
             chat.end_turn()
@@ -90,30 +207,46 @@ def run_lfm2_prediction(
             # Use generate_interleaved for chat
             generation_iterator = model.generate_interleaved(
                 **chat,  # Pass ChatState directly
-                max_new_tokens=256,
+                max_new_tokens=LFM2_MAX_NEW_TOKENS,
                 audio_temperature=0.8,
                 audio_top_k=64,
             )
             logger.info("Starting LFM2 interleaved generation (Chat)...")
 
         # --- Collect generated text tokens ---
+        # Accumulate into a preallocated on-device buffer and convert once at the end:
+        # a per-token .item() syncs the device every step
+        text_tokenizer = processor.text
+        eos_id = getattr(text_tokenizer, "eos_token_id", None)
+        token_ids = torch.empty(LFM2_MAX_NEW_TOKENS, dtype=torch.long, device=model_device)
+        num_tokens = 0
+        # liquid_audio's iterators only yield tensors: text tokens are scalars, audio frames have numel > 1
         for t in generation_iterator:
-            if isinstance(t, torch.Tensor) and t.numel() == 1:
-                generated_token_ids.append(t.item())
-            elif isinstance(t, torch.Tensor) and t.numel() > 1:
-                pass  # Ignore audio tokens
-
-        if not generated_token_ids:
+            if t.numel() == 1:
+                token_ids[num_tokens] = t.view(())
+                num_tokens += 1
+                # Stop decoding after EOS ourselves rather than letting the iterator run on; checked every
+                # few tokens so the loop still syncs only once per LFM2_EOS_CHECK_INTERVAL tokens
+                if num_tokens == LFM2_MAX_NEW_TOKENS or (
+                    num_tokens % LFM2_EOS_CHECK_INTERVAL == 0 and _lfm2_should_stop(token_ids, num_tokens, eos_id, text_tokenizer)
+                ):
+                    break
+            # Otherwise an audio token; ignored
+        if hasattr(generation_iterator, "close"):
+            generation_iterator.close()  # Ends generation if we broke out early
+
+        if num_tokens == 0:
             logger.warning("No text tokens were generated.")
             return ""
+        generated_token_ids = token_ids[:num_tokens].tolist()
 
-        # Decode using the text tokenizer part of the processor
-        text_tokenizer = processor.text
-        full_generated_text = text_tokenizer.decode(generated_token_ids, skip_special_tokens=True)
-
-        full_generated_text = full_generated_text.strip()
-        if hasattr(text_tokenizer, "eos_token") and text_tokenizer.eos_token and full_generated_text.endswith(text_tokenizer.eos_token):
-            full_generated_text = full_generated_text[: -len(text_tokenizer.eos_token)].rstrip()
+        # Decode using the text tokenizer part of the processor. Everything from the first EOS on is
+        # dropped by id before decoding, which also holds for EOS tokens that decode to several pieces.
+        if eos_id is not None and eos_id in generated_token_ids:
+            generated_token_ids = generated_token_ids[: generated_token_ids.index(eos_id)]
+        full_generated_text = text_tokenizer.decode(generated_token_ids, skip_special_tokens=True).strip()
+        if LFM2_MAX_CHARS > 0:
+            full_generated_text = full_generated_text[:LFM2_MAX_CHARS]
 
         logger.info(f"LFM2 generated text: '{full_generated_text}'")
         return full_generated_text
@@ -123,6 +256,53 @@ def run_lfm2_prediction(
         raise RuntimeError(f"LFM2 prediction failed: {e}")
 
 
+def _common_prefix_len(a: tuple[int, ...], b: tuple[int, ...]) -> int:
+    """Number of leading token ids shared by a and b."""
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+def _lookup_prefix_cache(model: Any, prompt_ids: tuple[int, ...]) -> Any:
+    """Returns a private DynamicCache covering the longest cached prefix of prompt_ids, or a fresh one."""
+    with _prefix_cache_lock:
+        entries = _prefix_caches.setdefault(model, OrderedDict())
+        best_key, best_len = None, 0
+        for key in entries or ():
+            common = _common_prefix_len(key, prompt_ids)
+            if common > best_len:
+                best_key, best_len = key, common
+        # At least one prompt token must be fed to generate()
+        reuse_len = min(best_len, len(prompt_ids) - 1)
+        # A short overlap (BOS, a shared template opener) saves less prefill than the copy costs
+        if best_key is None or reuse_len < TEXT_PREFIX_MIN_REUSE:
+            return DynamicCache()
+        entries.move_to_end(best_key)
+        cached = entries[best_key]
+
+    # Copy only the reused positions of each layer; the stored entry stays intact for other requests
+    cache = DynamicCache.from_legacy_cache(
+        tuple((keys[..., :reuse_len, :].clone(), values[..., :reuse_len, :].clone()) for keys, values in cached.to_legacy_cache())
+    )
+    logger.info(f"Reusing prompt KV cache for {reuse_len}/{len(prompt_ids)} tokens.")
+    return cache
+
+
+def _store_prefix_cache(model: Any, prompt_ids: tuple[int, ...], cache: Any) -> None:
+    """Keeps the prompt part of a cache filled by generate() for later requests."""
+    cache.crop(len(prompt_ids))
+    with _prefix_cache_lock:
+        entries = _prefix_caches.get(model)
+        if entries is None:
+            return
+        entries[prompt_ids] = cache
+        entries.move_to_end(prompt_ids)
+        while len(entries) > TEXT_PREFIX_CACHE_SIZE:
+            entries.popitem(last=False)
+
+
 def run_text_shap_prediction(
     text: str,
     model: Any,  # Standard HF CausalLM
@@ -131,6 +311,18 @@ def run_text_shap_prediction(
 ) -> str:
     """Runs prediction for standard text models (text_shap mode)."""
     logger.info("Running prediction in text_shap mode.")
+    return run_text_shap_prediction_batch([text], model=model, tokenizer=tokenizer, model_device=model_device)[0]
+
+
+@torch.inference_mode()
+def run_text_shap_prediction_batch(
+    texts: list[str],
+    model: Any,  # Standard HF CausalLM
+    tokenizer: Any,  # Standard HF Tokenizer
+    model_device: str,
+) -> list[str]:
+    """Runs one padded generate() call for several text_shap prompts, returning one output per prompt."""
+    logger.info(f"Running batched prediction in text_shap mode (batch_size={len(texts)}).")
     try:
         # --- FIX: Ensure pad_token is set for models like GPT-2 ---
         if tokenizer.pad_token is None:
@@ -138,7 +330,20 @@ def run_text_shap_prediction(
             tokenizer.pad_token = tokenizer.eos_token
         # --- END FIX ---
 
-        inputs = tokenizer(text, return_tensors="pt").to(model_device)
+        # Decoder-only models need left padding so every prompt ends at the same position
+        current_padding_side = tokenizer.padding_side
+        tokenizer.padding_side = "left"
+        try:
+            inputs = tokenizer(
+                texts,
+                return_tensors="pt",
+                padding=True,
+                return_attention_mask=True,
+                return_token_type_ids=False,
+                return_offsets_mapping=False,
+            ).to(model_device)
+        finally:
+            tokenizer.padding_side = current_padding_side
 
         # Get IDs after pad_token may have been set
         eos_token_id = tokenizer.eos_token_id
@@ -148,21 +353,38 @@ def run_text_shap_prediction(
         if eos_token_id is None:
             logger.warning("Tokenizer eos_token_id is None.")
 
-        with torch.no_grad():
-            predicted_ids = model.generate(
-                input_ids=inputs.input_ids,
-                attention_mask=inputs.attention_mask,  # --- FIX: Pass attention_mask ---
-                max_new_tokens=50,
-                eos_token_id=eos_token_id,
-                pad_token_id=pad_token_id,
-            )
+        generate_kwargs = {
+            "input_ids": inputs.input_ids,
+            "attention_mask": inputs.attention_mask,  # --- FIX: Pass attention_mask ---
+            "max_new_tokens": 50,
+            "eos_token_id": eos_token_id,
+            "pad_token_id": pad_token_id,
+        }
+
+        # Unpadded single prompts can resume from a cached prompt prefix instead of prefilling from scratch
+        predicted_ids = None
+        if len(texts) == 1 and TEXT_PREFIX_CACHE_SIZE > 0 and _prefix_caches.get(model, ()) is not None:
+            prompt_ids = tuple(inputs.input_ids[0].tolist())
+            try:
+                cache = _lookup_prefix_cache(model, prompt_ids)
+                predicted_ids = model.generate(**generate_kwargs, past_key_values=cache, use_cache=True)
+                _store_prefix_cache(model, prompt_ids, cache)
+            except (TypeError, AttributeError, ValueError) as e:
+                # Cache incompatibility only (e.g. models that require their own cache class, or no crop() on
+                # older transformers); don't try again for this model. OOM and other runtime errors propagate.
+                logger.warning(f"Prompt KV cache reuse failed, disabling it for this model: {e}")
+                with _prefix_cache_lock:
+                    _prefix_caches[model] = None
+
+        if predicted_ids is None:
+            predicted_ids = model.generate(**generate_kwargs)
 
         input_token_len = inputs["input_ids"].shape[1]
         generated_ids = predicted_ids[:, input_token_len:]
-        generated_text = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        generated_texts = [t.strip() for t in tokenizer.batch_decode(generated_ids, skip_special_tokens=True)]
 
-        logger.info(f"Text model generated text: '{generated_text}'")
-        return generated_text.strip()
+        logger.info(f"Text model generated texts: {generated_texts}")
+        return generated_texts
     except Exception as e:
         logger.exception(f"Error during standard text prediction: {e}")
         raise RuntimeError(f"Text prediction failed: {e}")
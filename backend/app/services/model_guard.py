@@ -0,0 +1,50 @@
+# backend/app/services/model_guard.py
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+
+class ModelStateGuard:
+    """
+    Reader/writer guard around the loaded model.
+
+    Requests hold a read lease for as long as they use a model; /models/load and
+    /models/unload take the write side, which stops new leases and waits for the
+    in-flight ones to drain before the model is swapped out.
+    """
+
+    def __init__(self) -> None:
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[None]:
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._writing)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[None]:
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._writing)
+            # Claim the write side first so requests arriving while we drain queue behind us
+            self._writing = True
+            try:
+                await self._cond.wait_for(lambda: self._readers == 0)
+            except BaseException:
+                self._writing = False
+                self._cond.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writing = False
+                self._cond.notify_all()
@@ -1,20 +1,86 @@
 # backend/app/services/model_loader.py
 import logging
+import os
 from typing import Any, Literal
 
 import torch
-from liquid_audio import LFM2AudioModel, LFM2AudioProcessor
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from liquid_audio import ChatState, LFM2AudioModel, LFM2AudioProcessor
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 
 logger = logging.getLogger(__name__)
 
+# Let the Rust tokenizers batch-encode in parallel (SHAP calls the tokenizer on lists of
+# perturbations). The library disables this itself in forked children to avoid deadlocks.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+# Opt-in bfloat16 cast of LFM2 (LFM2_BF16=1). It casts the whole wrapper, audio encoder and codec included,
+# and transcripts have not been validated against the library's default dtype, so it is off by default.
+LFM2_BF16 = os.getenv("LFM2_BF16") == "1"
+
+# Opt-in torch.compile of the LFM2 submodules (LFM2_TORCH_COMPILE=1). Compilation is lazy, so the first
+# generation after a load pays the compile cost (typically tens of seconds) before the speedup applies.
+LFM2_TORCH_COMPILE = os.getenv("LFM2_TORCH_COMPILE") == "1"
+LFM2_COMPILE_MODE = os.getenv("LFM2_COMPILE_MODE", "reduce-overhead")
+
+# Run one tiny generation right after loading on CUDA so the first request doesn't pay cuDNN autotuning,
+# allocator growth and kernel JIT (MODEL_WARMUP=0 disables)
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+
 # Keep map for text_shap mode
 PRECISION_MAP = {
     "float32": torch.float32,
     "float16": torch.float16,
     "bfloat16": torch.bfloat16,
+    "nf4": torch.bfloat16,  # Compute dtype; weights stay 4-bit
 }
 
+# Precisions whose device placement is done by bitsandbytes at load time
+QUANTIZED_PRECISIONS = ("int8", "nf4")
+
+
+def _optimize_lfm2(model: Any, device: str) -> Any:
+    """Optionally cast LFM2 weights to bfloat16 (where the GPU supports it) and compile its submodules."""
+    if LFM2_BF16 and str(device).startswith("cuda") and torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+        param = next(model.parameters(), None)
+        # Decoding is bandwidth-bound; only upcast-loaded fp32 weights are touched, library-chosen half dtypes are kept
+        if param is not None and param.dtype == torch.float32:
+            model.to(dtype=torch.bfloat16)
+            logger.info("Cast LFM2 weights from float32 to bfloat16.")
+
+    if LFM2_TORCH_COMPILE and hasattr(torch, "compile"):
+        # generate_sequential/generate_interleaved live on the wrapper and call its submodules, so the
+        # submodules are compiled in place; wrapping the model itself would only compile forward()
+        compiled = []
+        for name, child in model.named_children():
+            if hasattr(child, "compile"):
+                child.compile(mode=LFM2_COMPILE_MODE, fullgraph=False)
+                compiled.append(name)
+        logger.info(f"torch.compile (mode={LFM2_COMPILE_MODE}) enabled for LFM2 submodules: {compiled}. First generation will be slow.")
+    return model
+
+
+@torch.inference_mode()
+def _warm_up(mode: str, model: Any, processor: Any) -> None:
+    """Runs a throwaway one-token generation; failures are logged and never fail the load."""
+    torch.backends.cudnn.benchmark = True
+    try:
+        if mode == "lfm2":
+            chat = ChatState(processor)
+            chat.new_turn("user")
+            chat.add_audio(torch.zeros(1, 2400), 24000)  # 0.1 s of silence at the LFM2 input rate
+            chat.end_turn()
+            chat.new_turn("assistant")
+            for _ in model.generate_sequential(**chat, max_new_tokens=1):
+                pass
+        else:
+            inputs = processor("hi", return_tensors="pt").to(model._cached_device)
+            pad_token_id = processor.pad_token_id if processor.pad_token_id is not None else processor.eos_token_id
+            model.generate(**inputs, max_new_tokens=1, pad_token_id=pad_token_id)
+        torch.cuda.synchronize()
+        logger.info("Model warm-up generation completed.")
+    except Exception as e:
+        logger.warning(f"Model warm-up failed (first request will be slower): {e}")
+
 
 def load_model(
     mode: Literal["lfm2", "text_shap"],
@@ -52,9 +118,21 @@ def load_model(
             logger.info("Attempting int8 quantization for text_shap model.")
             load_kwargs["load_in_8bit"] = True
             load_kwargs.pop("torch_dtype", None)
+        elif precision == "nf4":
+            # NF4 keeps weights 4-bit during compute (int8 dequantizes per matmul), so it gives the lowest
+            # peak VRAM and weight bandwidth per decode step; int8 remains as the fallback option
+            logger.info("Attempting 4-bit NF4 quantization for text_shap model.")
+            load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch_dtype,
+                bnb_4bit_use_double_quant=True,
+            )
 
         try:
-            processor = AutoTokenizer.from_pretrained(model_id)
+            processor = AutoTokenizer.from_pretrained(model_id, use_fast=True)
+            if not getattr(processor, "is_fast", False):
+                logger.warning(f"No fast tokenizer available for {model_id}; SHAP explanations will tokenize slowly.")
             model = AutoModelForCausalLM.from_pretrained(model_id, **load_kwargs)
         except Exception as e:
             logger.exception(f"Failed to load text_shap model/tokenizer for {model_id}: {e}")
@@ -62,8 +140,8 @@ def load_model(
     else:
         raise ValueError(f"Invalid mode specified: {mode}")
 
-    # Move model to device (unless using int8 which handles it)
-    if precision != "int8" or mode == "lfm2":  # Always move LFM2 after loading
+    # Move model to device (unless quantized, where bitsandbytes handles it)
+    if precision not in QUANTIZED_PRECISIONS or mode == "lfm2":  # Always move LFM2 after loading
         try:
             model.to(device)
             logger.info(f"Model moved to requested device: {device}")
@@ -74,8 +152,20 @@ def load_model(
                 torch.cuda.empty_cache()
             raise RuntimeError(f"Failed to move model to device {device}: {e}")
     else:
-        logger.info("Device placement for int8 text_shap model handled by bitsandbytes.")
+        logger.info(f"Device placement for {precision} text_shap model handled by bitsandbytes.")
+
+    if mode == "lfm2":
+        model = _optimize_lfm2(model, device)
 
     model.eval()
+
+    # Resolve placement once, after moving/casting/compiling; inference reads these instead of walking parameters
+    param = next(model.parameters(), None)
+    model._cached_device = param.device if param is not None else None
+    model._cached_dtype = param.dtype if param is not None else None
+
+    if MODEL_WARMUP and model._cached_device is not None and model._cached_device.type == "cuda":
+        _warm_up(mode, model, processor)
+
     # Return only model and processor
     return model, processor
@@ -0,0 +1,49 @@
+# backend/tests/conftest.py
+import os
+import tempfile
+
+import pytest
+import torch
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+# app.db builds its engine at import; point it at a throwaway SQLite file instead of Postgres
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/shap_explainer_test.db")
+
+# Words the tiny tokenizer knows; anything else maps to <unk>
+VOCAB_WORDS = [f"w{i}" for i in range(60)]
+
+
+@pytest.fixture
+def tiny_tokenizer() -> PreTrainedTokenizerFast:
+    """Whitespace word-level tokenizer built in memory, so tests never hit the Hub."""
+    vocab = {"<unk>": 0, "<eos>": 1, **{word: i + 2 for i, word in enumerate(VOCAB_WORDS)}}
+    backend = Tokenizer(WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = Whitespace()
+    return PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", eos_token="<eos>")
+
+
+@pytest.fixture
+def tiny_model(tiny_tokenizer: PreTrainedTokenizerFast) -> GPT2LMHeadModel:
+    """Two-layer GPT-2 with seeded random weights, on CPU."""
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(tiny_tokenizer),
+        n_positions=128,
+        n_embd=32,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=tiny_tokenizer.eos_token_id,
+        eos_token_id=tiny_tokenizer.eos_token_id,
+    )
+    model = GPT2LMHeadModel(config).eval()
+    model._cached_device = torch.device("cpu")
+    model._cached_dtype = torch.float32
+    return model
+
+
+def words(*indices: int) -> str:
+    """Prompt made of the given vocabulary words."""
+    return " ".join(VOCAB_WORDS[i] for i in indices)
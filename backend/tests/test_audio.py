@@ -0,0 +1,60 @@
+# backend/tests/test_audio.py
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+import soxr
+import torch
+
+from app.services import inference
+from app.services.inference import preprocess_audio
+
+
+def _wav(samples: np.ndarray, sample_rate: int) -> io.BytesIO:
+    """Float WAV in memory, so decoded samples match the input exactly."""
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, format="WAV", subtype="FLOAT")
+    buf.seek(0)
+    return buf
+
+
+def _noise(num_frames: int, channels: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.uniform(-0.5, 0.5, size=(num_frames, channels)).astype(np.float32)
+
+
+def test_mono_at_target_rate_is_decoded_as_is():
+    samples = _noise(2400, 1)
+    audio, sample_rate = preprocess_audio(_wav(samples, 24000), target_sr=24000)
+    assert sample_rate == 24000
+    assert audio.shape == (1, 2400) and audio.dtype == torch.float32
+    np.testing.assert_array_equal(audio[0].numpy(), samples[:, 0])
+
+
+def test_stereo_is_mixed_to_mono():
+    samples = _noise(2400, 2)
+    audio, _ = preprocess_audio(_wav(samples, 24000), target_sr=24000)
+    np.testing.assert_allclose(audio[0].numpy(), samples.mean(axis=1), rtol=1e-6, atol=1e-7)
+
+
+def test_resampling_uses_soxr():
+    samples = _noise(4800, 2)
+    audio, sample_rate = preprocess_audio(_wav(samples, 48000), target_sr=24000)
+    expected = soxr.resample(samples.mean(axis=1), 48000, 24000, quality="HQ")
+    assert sample_rate == 24000
+    assert audio.shape == (1, expected.shape[0])
+    np.testing.assert_allclose(audio[0].numpy(), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_audio_over_the_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(inference, "MAX_AUDIO_SECONDS", 0.5)
+    with pytest.raises(ValueError, match="limit is 0.5s"):
+        preprocess_audio(_wav(_noise(24000, 1), 24000), target_sr=24000)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="pinned host memory needs CUDA")
+@pytest.mark.parametrize(("channels", "sample_rate"), [(1, 24000), (2, 24000), (2, 48000)])
+def test_output_is_pinned_when_cuda_is_available(channels, sample_rate):
+    audio, _ = preprocess_audio(_wav(_noise(4800, channels), sample_rate), target_sr=24000)
+    assert audio.is_pinned()
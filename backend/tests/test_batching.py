@@ -0,0 +1,64 @@
+# backend/tests/test_batching.py
+import asyncio
+
+from app.services import batching, inference
+from app.services.batching import TextPredictionBatcher, _PendingPrediction
+from tests.conftest import words
+
+
+def _pending(text: str, model: object) -> _PendingPrediction:
+    return _PendingPrediction(text, model, tokenizer=None, model_device="cpu", future=None)
+
+
+def test_group_splits_by_model_and_length_bucket():
+    batcher = TextPredictionBatcher(asyncio.Semaphore(1), bucket_chars=10)
+    model_a, model_b = object(), object()
+    pending = [_pending("short", model_a), _pending("x" * 25, model_a), _pending("tiny", model_a), _pending("short", model_b)]
+
+    groups = batcher._group(pending)
+    assert [[item.text for item in group] for group in groups] == [["short", "tiny"], ["x" * 25], ["short"]]
+    assert [group[0].model for group in groups] == [model_a, model_a, model_b]
+
+
+def test_batched_results_match_single_requests(monkeypatch, tiny_model, tiny_tokenizer):
+    monkeypatch.setattr(inference, "TEXT_PREFIX_CACHE_SIZE", 0)
+    prompts = [words(1, 2, 3, 4, 5), words(6, 7, 8), words(9, 10, 11, 12)]
+    expected = [inference.run_text_shap_prediction(p, model=tiny_model, tokenizer=tiny_tokenizer, model_device="cpu") for p in prompts]
+
+    batch_sizes = []
+    run_batch = batching.run_text_shap_prediction_batch
+
+    def spy(texts, **kwargs):
+        batch_sizes.append(len(texts))
+        return run_batch(texts, **kwargs)
+
+    monkeypatch.setattr(batching, "run_text_shap_prediction_batch", spy)
+
+    async def submit_all():
+        batcher = TextPredictionBatcher(asyncio.Semaphore(1), max_batch_size=8, max_wait_ms=50)
+        try:
+            return await asyncio.gather(*(batcher.submit(p, model=tiny_model, tokenizer=tiny_tokenizer, model_device="cpu") for p in prompts))
+        finally:
+            await batcher.aclose()
+
+    assert asyncio.run(submit_all()) == expected
+    assert batch_sizes == [3]
+
+
+def test_batch_failure_reaches_every_request(monkeypatch):
+    def fail(texts, **kwargs):
+        raise RuntimeError("generate failed")
+
+    monkeypatch.setattr(batching, "run_text_shap_prediction_batch", fail)
+
+    async def submit_all():
+        batcher = TextPredictionBatcher(asyncio.Semaphore(1), max_wait_ms=50)
+        try:
+            return await asyncio.gather(
+                *(batcher.submit(t, model=None, tokenizer=None, model_device="cpu") for t in ("a", "b")), return_exceptions=True
+            )
+        finally:
+            await batcher.aclose()
+
+    results = asyncio.run(submit_all())
+    assert [str(r) for r in results] == ["generate failed", "generate failed"]
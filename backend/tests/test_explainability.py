@@ -0,0 +1,47 @@
+# backend/tests/test_explainability.py
+import numpy as np
+import pytest
+
+from app.models import ModelState
+from app.services.explainability import explain_text, explainer_cache
+
+
+@pytest.fixture
+def text_shap_state(tiny_model, tiny_tokenizer) -> ModelState:
+    return ModelState(mode="text_shap", model=tiny_model, processor=tiny_tokenizer, device="cpu")
+
+
+def _count_forward_rows(model) -> list[int]:
+    """Records the batch size of every forward pass through model."""
+    rows: list[int] = []
+    model.register_forward_hook(lambda module, args, kwargs, output: rows.append(kwargs["input_ids"].shape[0]), with_kwargs=True)
+    return rows
+
+
+def test_explain_text_returns_tokenizer_pieces(text_shap_state):
+    tokens, attributions = explain_text("w1 w2 w3 w4", text_shap_state, max_evals=64)
+    assert tokens == ["w1", "w2", "w3", "w4"]
+    assert len(attributions) == 4
+    assert all(value >= 0 for value in attributions)
+
+
+def test_predict_memo_skips_rows_seen_before(text_shap_state, tiny_model):
+    explain_text("w1 w2 w3", text_shap_state, max_evals=16)
+    _, predict_ctx = explainer_cache[tiny_model]["cpu_partition_text_shap"]
+    predict = predict_ctx["predict"]
+    predict_ctx["memo"].clear()
+    forward_rows = _count_forward_rows(tiny_model)
+
+    # Duplicate rows within one call are scored once
+    first = predict(["w5 w6", "w5 w6", "w7"])
+    assert forward_rows == [2]
+    np.testing.assert_array_equal(first[0], first[1])
+
+    # A repeat is served from the memo without touching the model
+    again = predict(["w7", "w5 w6"])
+    assert forward_rows == [2]
+    np.testing.assert_array_equal(again, first[[2, 0]])
+
+    # Only the unseen row goes to the model
+    predict(["w5 w6", "w8"])
+    assert forward_rows == [2, 1]
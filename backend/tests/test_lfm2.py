@@ -0,0 +1,69 @@
+# backend/tests/test_lfm2.py
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from app.services import inference
+from app.services.inference import run_lfm2_prediction
+
+
+class _FakeLFM2:
+    """Stands in for LFM2AudioModel: yields a fixed stream of text tokens and audio frames."""
+
+    def __init__(self, stream: list[torch.Tensor]):
+        self._cached_device = torch.device("cpu")
+        self.stream = stream
+        self.pulled = 0
+        self.closed = False
+
+    def generate_interleaved(self, **kwargs):
+        try:
+            for item in self.stream:
+                self.pulled += 1
+                yield item
+        finally:
+            self.closed = True
+
+
+@pytest.fixture
+def lfm2_processor(tiny_tokenizer) -> SimpleNamespace:
+    # ChatState only needs the processor's device and text tokenizer for text-only turns
+    return SimpleNamespace(device=torch.device("cpu"), text=tiny_tokenizer)
+
+
+def _text(tokenizer, *words: str) -> list[torch.Tensor]:
+    return [torch.tensor(tokenizer.convert_tokens_to_ids(word)) for word in words]
+
+
+def test_generation_stops_at_the_check_after_eos(monkeypatch, lfm2_processor, tiny_tokenizer):
+    monkeypatch.setattr(inference, "LFM2_EOS_CHECK_INTERVAL", 4)
+    audio_frame = torch.zeros(8, dtype=torch.long)
+    stream = [*_text(tiny_tokenizer, "w0", "w1"), audio_frame, *_text(tiny_tokenizer, "w2", "<eos>")]
+    stream += _text(tiny_tokenizer, *["w9"] * 100)
+    model = _FakeLFM2(stream)
+
+    text = run_lfm2_prediction("w5", audio_tensor=None, sample_rate=None, model=model, processor=lfm2_processor)
+
+    assert text == "w0 w1 w2"
+    # EOS is the 4th text token and the check runs every 4: nothing after it is pulled
+    assert model.pulled == 5
+    assert model.closed
+
+
+def test_eos_found_at_a_later_check(monkeypatch, lfm2_processor, tiny_tokenizer):
+    monkeypatch.setattr(inference, "LFM2_EOS_CHECK_INTERVAL", 4)
+    stream = _text(tiny_tokenizer, "w0", "<eos>", *["w9"] * 100)
+    model = _FakeLFM2(stream)
+
+    assert run_lfm2_prediction("w5", audio_tensor=None, sample_rate=None, model=model, processor=lfm2_processor) == "w0"
+    assert model.pulled == 4
+
+
+def test_generation_without_eos_stops_at_the_token_budget(monkeypatch, lfm2_processor, tiny_tokenizer):
+    model = _FakeLFM2(_text(tiny_tokenizer, *["w9"] * (inference.LFM2_MAX_NEW_TOKENS + 50)))
+
+    text = run_lfm2_prediction("w5", audio_tensor=None, sample_rate=None, model=model, processor=lfm2_processor)
+
+    assert text.split() == ["w9"] * inference.LFM2_MAX_NEW_TOKENS
+    assert model.pulled == inference.LFM2_MAX_NEW_TOKENS
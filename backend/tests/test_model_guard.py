@@ -0,0 +1,78 @@
+# backend/tests/test_model_guard.py
+import asyncio
+
+import httpx
+
+from app.api.controllers.ml import get_model_state, model_state_guard
+from app.main import app
+from app.models import loaded_model_state
+from app.services.model_guard import ModelStateGuard
+
+
+def test_writer_drains_readers_and_holds_off_new_ones():
+    async def run():
+        guard, log = ModelStateGuard(), []
+
+        async def reader(name: str, hold: asyncio.Event):
+            async with guard.read():
+                log.append(f"{name} start")
+                await hold.wait()
+                log.append(f"{name} end")
+
+        async def writer():
+            async with guard.write():
+                log.append("write")
+
+        release = asyncio.Event()
+        first = asyncio.create_task(reader("r1", release))
+        await asyncio.sleep(0)
+        write = asyncio.create_task(writer())
+        await asyncio.sleep(0)
+        late = asyncio.create_task(reader("r2", asyncio.Event()))
+        await asyncio.sleep(0.01)
+        # The writer waits on r1, and r2 queues behind the writer
+        assert log == ["r1 start"]
+
+        release.set()
+        await write
+        late.cancel()
+        await asyncio.gather(first, late, return_exceptions=True)
+        return log
+
+    assert asyncio.run(run()) == ["r1 start", "r1 end", "write", "r2 start"]
+
+
+def test_snapshot_outlives_a_swap():
+    async def run():
+        loaded_model_state.mode, loaded_model_state.model = "text_shap", "old-model"
+        try:
+            leases = get_model_state()
+            state = await anext(leases)
+            loaded_model_state.model = "new-model"
+            assert state.model == "old-model"
+            await leases.aclose()
+        finally:
+            loaded_model_state.reset()
+
+    asyncio.run(run())
+
+
+def test_unload_waits_for_in_flight_requests():
+    async def run():
+        loaded_model_state.mode, loaded_model_state.model, loaded_model_state.model_id = "text_shap", object(), "tiny"
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                async with model_state_guard.read():
+                    unload = asyncio.create_task(client.post("/api/ml/models/unload"))
+                    await asyncio.sleep(0.05)
+                    # Still held by the in-flight request
+                    assert not unload.done()
+                    assert loaded_model_state.model is not None
+                response = await unload
+            return response.json()
+        finally:
+            loaded_model_state.reset()
+
+    assert asyncio.run(run()) == {"message": "Model 'tiny' unloaded."}
+    assert loaded_model_state.model is None
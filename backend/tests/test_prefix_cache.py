@@ -0,0 +1,44 @@
+# backend/tests/test_prefix_cache.py
+from transformers import DynamicCache
+
+from app.services import inference
+from tests.conftest import words
+
+
+def _generate(prompts, model, tokenizer):
+    return [inference.run_text_shap_prediction(p, model=model, tokenizer=tokenizer, model_device="cpu") for p in prompts]
+
+
+def test_cached_generation_matches_uncached(monkeypatch, tiny_model, tiny_tokenizer):
+    base = list(range(30))
+    prompts = [words(*base), words(*base[:25], 40, 41, 42, 43, 44), words(*base)]
+
+    monkeypatch.setattr(inference, "TEXT_PREFIX_CACHE_SIZE", 0)
+    expected = _generate(prompts, tiny_model, tiny_tokenizer)
+
+    reused = []
+    from_legacy_cache = DynamicCache.from_legacy_cache
+
+    def spy(past_key_values):
+        reused.append(past_key_values[0][0].shape[-2])
+        return from_legacy_cache(past_key_values)
+
+    monkeypatch.setattr(inference, "TEXT_PREFIX_CACHE_SIZE", 4)
+    monkeypatch.setattr(inference.DynamicCache, "from_legacy_cache", spy)
+    assert _generate(prompts, tiny_model, tiny_tokenizer) == expected
+    # Second prompt shares 25 tokens with the first; the repeat reuses all but its last token
+    assert reused == [25, 29]
+
+
+def test_short_overlap_is_not_copied(monkeypatch, tiny_model, tiny_tokenizer):
+    monkeypatch.setattr(inference, "TEXT_PREFIX_CACHE_SIZE", 4)
+    _generate([words(*range(30))], tiny_model, tiny_tokenizer)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cache entry copied for a one-token overlap")
+
+    monkeypatch.setattr(inference.DynamicCache, "from_legacy_cache", fail)
+    # Only the first token is shared with the cached prompt
+    prompt_ids = tuple(tiny_tokenizer(words(0, *range(31, 50)))["input_ids"])
+    cache = inference._lookup_prefix_cache(tiny_model, prompt_ids)
+    assert cache.get_seq_length() == 0
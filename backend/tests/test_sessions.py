@@ -0,0 +1,52 @@
+# backend/tests/test_sessions.py
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+from sqlmodel import SQLModel
+
+from app.db import engine
+from app.main import app
+from app.models import Session
+
+
+async def _seed(created_at: list[datetime]) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.execute(Session.__table__.insert(), [{"name": f"s{i}", "created_at": ts} for i, ts in enumerate(created_at)])
+
+
+async def _list(client: httpx.AsyncClient, **params) -> httpx.Response:
+    response = await client.get("/api/sessions/", params=params)
+    assert response.status_code == 200
+    return response
+
+
+def test_keyset_pages_cover_ties_exactly_once():
+    older = datetime(2024, 1, 1, 12, 0, 0)
+    newer = older + timedelta(minutes=5)
+    # ids 1-3 share one timestamp, so page boundaries fall inside the tie
+    created_at = [newer, newer, newer, older, older]
+
+    async def run():
+        await _seed(created_at)
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                everything = (await _list(client)).json()
+
+                pages, params = [], {"limit": 2}
+                while True:
+                    response = await _list(client, **params)
+                    pages.append([row["id"] for row in response.json()])
+                    if "X-Next-Before" not in response.headers:
+                        return everything, pages
+                    params = {"limit": 2, "before": response.headers["X-Next-Before"], "before_id": response.headers["X-Next-Before-Id"]}
+        finally:
+            await engine.dispose()
+
+    everything, pages = asyncio.run(run())
+    # Unpaged listing is newest first, ties broken by id
+    assert [row["id"] for row in everything] == [3, 2, 1, 5, 4]
+    assert pages == [[3, 2], [1, 5], [4]]
@@ -1,10 +1,16 @@
 import argparse
 import sys
+import threading
 
 import numpy as np
 import sounddevice as sd
 import soundfile as sf
 
+# Capture/write 16-bit PCM: speech-grade, and half the bytes of float32 on disk and on decode
+INT16_FULL_SCALE = 32767
+# Peak below which a recording is reported as silent (~0.01 of full scale)
+SILENCE_THRESHOLD = 327
+
 
 def list_audio_devices():
     """Prints available audio devices."""
@@ -31,6 +37,34 @@ def list_audio_devices():
     print("-----------------------------\n")
 
 
+def _capture(num_frames: int, samplerate: int, blocksize: int = 1024) -> tuple[np.ndarray, int]:
+    """Records num_frames mono int16 samples via an InputStream callback into a preallocated buffer; returns (audio, int16 peak magnitude)."""
+    recording = np.empty((num_frames, 1), dtype=np.int16)
+    finished = threading.Event()
+    write_idx = 0
+    peak = 0
+
+    def callback(indata, frames, time_info, status):
+        nonlocal write_idx, peak
+        if status:
+            print(f"Input stream status: {status}", file=sys.stderr)
+        n = min(frames, num_frames - write_idx)
+        if n > 0:
+            block = indata[:n]
+            recording[write_idx : write_idx + n] = block
+            # Widen before negating: -(-32768) overflows int16
+            peak = max(peak, int(block.max()), -int(block.min()))
+            write_idx += n
+        if write_idx >= num_frames:
+            raise sd.CallbackStop
+
+    # finished_callback fires however the stream ends (buffer full, error or abort), so the wait can't hang
+    with sd.InputStream(samplerate=samplerate, channels=1, dtype="int16", blocksize=blocksize, callback=callback, finished_callback=finished.set):
+        finished.wait()
+
+    return recording[:write_idx], peak
+
+
 def record_audio(filename: str, duration: int, samplerate: int):
     """Records audio from the default microphone and saves it to a WAV file."""
 
@@ -49,21 +83,21 @@ def record_audio(filename: str, duration: int, samplerate: int):
 
     # Record audio
     try:
-        recording = sd.rec(int(duration * samplerate), samplerate=samplerate, channels=1, dtype="float32", blocking=True)
-        # Using blocking=True simplifies waiting, sd.wait() is not needed
+        recording, max_amplitude = _capture(int(duration * samplerate), samplerate)
 
         print("\nRecording finished.")
 
         # --- Diagnostic Check for Silence ---
-        max_amplitude = np.max(np.abs(recording))
-        if max_amplitude < 0.01:  # Threshold for considering it silent (adjust if needed)
-            print(f"WARNING: Recorded audio seems silent (max amplitude: {max_amplitude:.4f}). Check microphone input level and selection.")
+        # max_amplitude is the running int16 peak tracked block by block during capture
+        peak_level = max_amplitude / INT16_FULL_SCALE
+        if max_amplitude < SILENCE_THRESHOLD:  # Threshold for considering it silent (adjust if needed)
+            print(f"WARNING: Recorded audio seems silent (max amplitude: {peak_level:.4f}). Check microphone input level and selection.")
         else:
-            print(f"Audio recorded successfully (max amplitude: {max_amplitude:.4f}).")
+            print(f"Audio recorded successfully (max amplitude: {peak_level:.4f}).")
         # ------------------------------------
 
         # Save as WAV file
-        sf.write(filename, recording, samplerate)
+        sf.write(filename, recording, samplerate, subtype="PCM_16")
         print(f"Audio saved to '{filename}'")
 
     except Exception as e:
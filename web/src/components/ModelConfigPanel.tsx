@@ -172,6 +172,7 @@ const handleLoadModel = async () => {
                   <SelectItem value="float16">Float16</SelectItem>
                   <SelectItem value="bfloat16">BFloat16</SelectItem>
                   <SelectItem value="int8">Int8</SelectItem>
+                  <SelectItem value="nf4">NF4 (4-bit)</SelectItem>
                 </SelectContent>
               </Select>
             </div>